@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# Filename: Animation.py
+# Project Github: http://github.com/super3/ClassDev
+# Author: Shawn Wilkinson <me@super3.org>
+# Author Website: http://super3.org/
+# License: GPLv3 <http://gplv3.fsf.org/>
+
+# Imports
+import multiprocessing
+from GeoPrimitives import *
+from Line3D import DView
+from Line3D import Mesh
+
+# Worker State
+# Each worker process receives the scene once, when it starts, instead of once per frame.
+worker_scene = None
+
+def init_worker(scene):
+	global worker_scene
+	worker_scene = scene
+
+def draw_frame(job):
+	"""Renders one frame, and returns the image."""
+	index, camera, path, size, background, color, binary = job
+	a, b, vrp, cop, trans, scale = camera
+	view = DView(a, b, vrp, cop, worker_scene, trans, scale)
+
+	# Create a Blank Image
+	img = Image(size[0], size[1], array = numpy is not None)
+	img.fill(background)
+	# Draw Lines on Image
+	if numpy is not None:
+		img.blit_points(draw_lines(view.endpoints(), img.viewport()), color)
+	else:
+		for line in view.run():
+			line.border_color = color
+			img.blit(line)
+	return img
+
+def render_frame(job):
+	"""Renders and saves one frame. Only the path goes back, so a frame never outlives its worker's turn."""
+	index, camera, path, size, background, color, binary = job
+	# Create/Write Image
+	draw_frame(job).save(path % index, binary)
+	return path % index
+
+# Animation
+def animate(scene, cameras, path="frame%04d.ppm", size=(320, 240), background=Color(255,255,255),
+		color=Color(255,0,0), binary=False, processes=None):
+	"""
+	Renders a 3D wire-frame scene once for every camera, across a process pool, and
+	saves the frames as a numbered PPM sequence. The scene is a Mesh or a list of 3D
+	lines, and every camera is an (α, β, VRP, CoP, translate, scale) tuple. Frames are
+	handed out one at a time, so each worker only holds a single frame. Returns the
+	paths of the frames, in camera order.
+
+	"""
+	# Share the vertex points of the scene once, up front
+	if not isinstance(scene, Mesh): scene = Mesh.from_lines(scene)
+	jobs = ( (index, camera, path, size, background, color, binary) for index, camera in enumerate(cameras) )
+
+	# A single process renders in place, which is easier to debug. Each frame is saved in
+	# the background while the next one is drawn.
+	if processes == 1:
+		init_worker(scene)
+		futures = [ draw_frame(job).save_async(job[2] % job[0], binary) for job in jobs ]
+		return [ future.result() for future in futures ]
+
+	pool = multiprocessing.Pool(processes, init_worker, (scene,))
+	try:
+		return list( pool.imap(render_frame, jobs) )
+	finally:
+		pool.close()
+		pool.join()
+
+def turntable(frames, b, vrp, cop, trans, scale):
+	"""Returns the cameras for a full turn around the y-axis: α from 0 to 360 degrees, in frames steps."""
+	return [ (360 * i / frames, b, vrp, cop, trans, scale) for i in range(frames) ]
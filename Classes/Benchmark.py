@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# Filename: Benchmark.py
+# Project Github: http://github.com/super3/ClassDev
+# Author: Shawn Wilkinson <me@super3.org>
+# Author Website: http://super3.org/
+# License: GPLv3 <http://gplv3.fsf.org/>
+
+# Imports
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import timeit
+import Primitives
+from GeoPrimitives import *
+from Line3D import DView
+from Line3D import Line3D
+from Line3D import World3D
+
+# Timing
+def measure(func, repeat=3):
+	"""Returns the best wall time of one call of func, out of repeat runs long enough (0.2s) to time well."""
+	timer = timeit.Timer(func)
+	number, total = timer.autorange()
+	best = total / number
+	for i in range(repeat - 1):
+		best = min(best, timer.timeit(number) / number)
+	return best
+
+# Scenes
+def star(n, radius, x, y):
+	"""A star polygon of n vertex points around (x, y), alternating between radius and radius/2."""
+	points = []
+	for i in range(n):
+		r = radius if i % 2 == 0 else radius / 2
+		angle = 2 * math.pi * i / n
+		points.append( (round(x + r * math.cos(angle)), round(y + r * math.sin(angle))) )
+	return points
+
+def wireframe(edges, seed=1):
+	"""A 3D point list of random lines in front of the camera, for DView and World3D."""
+	rand = random.Random(seed)
+	return [ tuple( (rand.uniform(-50, 50), rand.uniform(-50, 50), rand.uniform(20, 80)) for j in range(2) ) for i in range(edges) ]
+
+# Cases
+def cases(quick=False):
+	"""
+	Yields (name, size, func, pixels, vertices) for every benchmark: func is timed, and
+	pixels and vertices are how many of each one call of it handles.
+
+	"""
+	pick = (lambda sizes: sizes[:2]) if quick else (lambda sizes: sizes)
+
+	# Primitives
+	for length in pick([100, 1000, 10000]):
+		line = Line(0, 0, length, length // 3)
+		line.draw()
+		yield "line border", length, (lambda line=line: line.draw()), len(line.border), 2
+	for shape, name, sizes in [ (lambda r: Circle(0, 0, r), "circle", [10, 100, 1000]), (lambda r: Ellipse(0, 0, r, r // 2), "ellipse", [20, 200, 2000]) ]:
+		for radius in pick(sizes):
+			border = shape(radius)
+			border.draw()
+			yield name + " border", radius, (lambda border=border: border.draw()), len(border.border), 1
+			filled = shape(radius).fill()
+			filled.draw()
+			yield name + " fill", radius, (lambda filled=filled: filled.draw()), len(filled.border) + count_spans(filled.spans), 1
+	for n in pick([4, 32, 256]):
+		border = Polygon(star(n, 500, 0, 0))
+		border.draw()
+		yield "polygon border", n, (lambda border=border: border.draw()), len(border.border), n
+		filled = Polygon(star(n, 500, 0, 0)).fill()
+		filled.draw()
+		yield "polygon fill", n, (lambda filled=filled: filled.draw()), len(filled.border) + count_spans(filled.spans), n
+
+	# Images
+	for array in ([False, True] if numpy is not None else [False]):
+		mode = " array" if array else " list"
+		for x, y in pick([(320, 240), (1280, 960), (3840, 2160)]):
+			size = "%dx%d" % (x, y)
+			img = Image(x, y, array=array)
+			yield "image fill" + mode, size, (lambda img=img: img.fill(Color(245, 245, 245))), x * y, 0
+			cover = Polygon([ (1, 0), (x, 0), (x, y - 1), (1, y - 1) ]).fill(Color(255, 0, 0))
+			img.blit(cover)
+			yield "image blit" + mode, size, (lambda img=img, cover=cover: img.blit(cover)), x * y, 4
+			path = os.path.join(tempfile.gettempdir(), "benchmark.ppm")
+			yield "image save P6" + mode, size, (lambda img=img: img.save(path, True)), x * y, 0
+			if x * y <= 1280 * 960:
+				yield "image save P3" + mode, size, (lambda img=img: img.save(path)), x * y, 0
+
+	# 3D pipeline
+	for edges in pick([12, 1200, 120000]):
+		lines = wireframe(edges)
+		yield "DView.run", edges, (lambda lines=lines: DView(45, -30, (0, 0, 50), (0, 0, 20), lines, (160, 120), 10).run()), 0, 2 * edges
+		if edges <= 12000:
+			world = World3D()
+			for start, end in lines: world.add( Line3D(start, end) )
+			def display(world=world):
+				# Project every time, instead of reusing the cached projection
+				world.cache.clear()
+				return world.display(20, (160, 120), 10)
+			yield "World3D.display", edges, display, 0, 2 * edges
+
+# Running
+def run(quick=False, repeat=3, match=None, out=sys.stdout):
+	"""Runs every benchmark (or the ones whose name contains match), and returns the results as a list of dicts."""
+	results = []
+	# Time the rasterizers themselves, not the raster cache
+	max_bytes = Primitives.raster_cache.max_bytes
+	Primitives.raster_cache.max_bytes = 0
+	try:
+		for name, size, func, pixels, vertices in cases(quick):
+			if match is not None and match not in name: continue
+			seconds = measure(func, repeat)
+			result = {
+				'name': name, 'size': str(size), 'seconds': seconds,
+				'pixels_per_s': pixels / seconds if pixels else None,
+				'vertices_per_s': vertices / seconds if vertices else None,
+			}
+			results.append(result)
+			out.write(format_result(result) + "\n")
+			out.flush()
+	finally:
+		Primitives.raster_cache.max_bytes = max_bytes
+	return results
+
+def format_rate(rate):
+	if rate is None: return "-"
+	for factor, suffix in [ (1e9, "G"), (1e6, "M"), (1e3, "k") ]:
+		if rate >= factor: return "%.2f%s" % (rate / factor, suffix)
+	return "%.2f" % rate
+
+def format_result(result):
+	return "%-22s %10s %12.6fs %10s px/s %10s vtx/s" % (result['name'], result['size'], result['seconds'],
+		format_rate(result['pixels_per_s']), format_rate(result['vertices_per_s']))
+
+# Saving and Comparing
+def save(results, path):
+	"""Saves results as JSON, along with the machine and versions they were measured on."""
+	data = {
+		'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+		'python': platform.python_version(),
+		'numpy': numpy.__version__ if numpy is not None else None,
+		'machine': platform.platform(),
+		'results': results,
+	}
+	f = open(path, 'w')
+	json.dump(data, f, indent=1)
+	f.close()
+
+def load(path):
+	f = open(path)
+	data = json.load(f)
+	f.close()
+	return data['results']
+
+def compare(old, new, threshold=0.1, out=sys.stdout):
+	"""
+	Compares two lists of results by name and size, and prints how much faster (or
+	slower) each benchmark got. Returns the ones that got more than threshold slower.
+
+	"""
+	before = dict( ((result['name'], result['size']), result) for result in old )
+	regressions = []
+	out.write("%-22s %10s %12s %12s %8s\n" % ("benchmark", "size", "before", "after", "speedup"))
+	for result in new:
+		key = (result['name'], result['size'])
+		if key not in before: continue
+		speedup = before[key]['seconds'] / result['seconds']
+		flag = ""
+		if speedup < 1 / (1 + threshold):
+			regressions.append(result)
+			flag = "  REGRESSION"
+		out.write("%-22s %10s %11.6fs %11.6fs %7.2fx%s\n" % (key[0], key[1], before[key]['seconds'], result['seconds'], speedup, flag))
+	return regressions
+
+# Main
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmarks the 2D primitives, images, and the 3D pipeline.")
+	parser.add_argument("--quick", action="store_true", help="only run the smaller sizes")
+	parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark, the best is kept")
+	parser.add_argument("--match", help="only run benchmarks whose name contains this")
+	parser.add_argument("--save", metavar="PATH", help="save the results as JSON")
+	parser.add_argument("--compare", metavar="PATH", help="compare against results saved earlier")
+	parser.add_argument("--threshold", type=float, default=0.1, help="slowdown that counts as a regression (default 0.1)")
+	args = parser.parse_args()
+
+	results = run(args.quick, args.repeat, args.match)
+	if args.save: save(results, args.save)
+	if args.compare:
+		regressions = compare(load(args.compare), results, args.threshold)
+		if len(regressions) > 0: sys.exit(1)
@@ -6,10 +6,19 @@
 # License: GPLv3 <http://gplv3.fsf.org/>
 
 # Imports
+import copy
 import math
 import operator
+import random
+from fractions import Fraction
 from Primitives import *
 
+# Optional Imports
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
 # Line Class
 class Line(Shape):
 	# Constructor
@@ -29,14 +38,14 @@ class Line(Shape):
 		try:
 			return (self.y2 - self.y1) / (self.x2 - self.x1)
 		except ZeroDivisionError:
-			print("ZeroDivisionError! " + str(self))
+			stats.debug("ZeroDivisionError! " + str(self))
 			return 0
 
 	def getSlopeTall(self):
 		try:
 			return (self.x2 - self.x1) / (self.y2 - self.y1)
 		except ZeroDivisionError:
-			print("ZeroDivisionError! " + str(self))
+			stats.debug("ZeroDivisionError! " + str(self))
 			return 0
 
 	def getIntercept(self):
@@ -53,54 +62,111 @@ class Line(Shape):
 		return (xc,yx)
 	def get_points(self):
 		return [(self.x1, self.y1), (self.x2, self.y2)]
+	def geometry(self):
+		return self.get_points(), ()
+	def bounds(self):
+		line = self.transformed()
+		x1, y1, x2, y2 = round(line.x1), round(line.y1), round(line.x2), round(line.y2)
+		return (min(x1,x2), min(y1,y2), max(x1,x2), max(y1,y2))
+
+	def outcode(self, x, y, window):
+		"""Cohen–Sutherland region code of a point for a (min_x, min_y, max_x, max_y) window: 1 left, 2 right, 4 below, 8 above."""
+		code = 0
+		if x < window[0]: code |= 1
+		elif x > window[2]: code |= 2
+		if y < window[1]: code |= 4
+		elif y > window[3]: code |= 8
+		return code
+
+	def walk(self, a1, b1, a2, b2, window=None):
+		"""
+		Steps one pixel at a time along the major axis a, from a1 to a2, and returns
+		the (a, b) points. The exact minor value is carried as b + r/da with an integer
+		remainder r, and rounded half to even like Python's round(). If an
+		(min_a, min_b, max_a, max_b) window is passed, the walk starts and stops at its
+		edges, so the points outside of it are never stepped through.
 
-	# Draw Functions
-	def draw_border(self):
+		"""
+		# Always walk in increasing a, so a line has the same pixels in both directions
+		if a1 > a2: a1, b1, a2, b2 = a2, b2, a1, b1
+		if window is None: window = (a1, min(b1,b2), a2, max(b1,b2))
+		min_a, min_b, max_a, max_b = window
+		da = a2 - a1
+		db = b2 - b1
+		if da == 0:
+			if min_a <= a1 <= max_a and min_b <= b1 <= max_b: return [(a1, b1)]
+			return []
 		solution = []
+		# Jump straight to the first a inside of the window
+		start = max(a1, min_a)
+		q, r = divmod(db * (start - a1), da)
+		b = b1 + q
+		for a in range(start, min(a2, max_a) + 1):
+			# Round b + r/da to the nearest integer, ties to even
+			if 2*r > da or (2*r == da and b % 2): point = b + 1
+			else: point = b
+			if min_b <= point <= max_b: solution.append( (a, point) )
+			# Past the window's far edge, so nothing else can be inside of it
+			elif (db >= 0 and point > max_b) or (db < 0 and point < min_b): break
+			# Advance the remainder, keeping 0 <= r < da
+			r += db
+			if r >= da:
+				r -= da
+				b += 1
+			elif r < 0:
+				r += da
+				b -= 1
+		return solution
+
+	# Draw Functions
+	def draw_border(self, window=None):
+		"""
+		An integer incremental (Bresenham style) line algorithm. The longer axis is
+		stepped one pixel at a time and the shorter axis is updated with integer adds
+		only, so there is no per-pixel slope or intercept evaluation. Lines are clipped
+		to the window, if one is passed, before any pixels are found.
+
+		"""
+		x1, y1, x2, y2 = round(self.x1), round(self.y1), round(self.x2), round(self.y2)
+
+		if window is not None:
+			code1 = self.outcode(x1, y1, window)
+			code2 = self.outcode(x2, y2, window)
+			# Both end points are outside of the same edge, so the line is rejected
+			if code1 & code2: return []
+			# Both end points are inside, so the line is accepted without clipping
+			if code1 | code2 == 0: window = None
 
 		# Find the x length |x1 − x2| and the y length |y1 − y2|
-		x_len = abs(self.x1 - self.x2)
-		y_len = abs(self.y1 - self.y2)
+		x_len = abs(x1 - x2)
+		y_len = abs(y1 - y2)
 
 		if x_len > y_len:
-			x_vals = []
-			# Find all the integer values from x1 to x2: [x1...x2]
-			for x in range(min(self.x1,self.x2+1), max(self.x1,self.x2+1)):
-				x_vals.append(x)
-			# Solve for the corresponding y values using Equation 2.1: [y1...y2]
-			for x in x_vals:
-				y = (self.getSlopeLong() * x) + self.getIntercept()
-				solution.append( (x, round(y)) )
+			# Walk all the integer values from x1 to x2: [x1...x2]
+			return self.walk(x1, y1, x2, y2, window)
 		else:
-			y_vals = []
-			# Find all the integer values from y1 to y2: [y1...y2]
-			for y in range(min(self.y1,self.y2+1), max(self.y1,self.y2+1)):
-				y_vals.append(y)
-			# Solve for the corresponding x values using Equation 2.4: [x1...x2]
-			for y in y_vals:
-				x = self.getSlopeTall()*y - self.getSlopeTall()*self.y1 + self.x1
-				solution.append( (round(x), y) )
-
-		return solution
+			# Walk all the integer values from y1 to y2: [y1...y2]
+			if window is not None: window = (window[1], window[0], window[3], window[2])
+			return [ (x, y) for y, x in self.walk(y1, x1, y2, x2, window) ]
 
 	def draw_inside(self):
 		return []
 
-	def draw(self):
-		self.border = self.draw_border()
+	def draw(self, window=None):
+		super(Line, self).draw(window)
 		return self.border
 
 	# Transformations 
+	def apply_matrix(self, matrix):
+		(self.x1, self.y1), (self.x2, self.y2) = matrix.apply(self.get_points())
+
 	def translate(self, x, y):
 		"""
 		A simple translate algorithm to translate a line drawing by xt and yt
 		is outlined in the following steps:
 
 		"""
-		self.x1 += x
-		self.x2 += x
-		self.y1 += y
-		self.y2 += y
+		return self.transform( Transform().translate(x, y) )
 
 	def rotate(self, x, y, angle):
 		"""
@@ -108,22 +174,9 @@ class Line(Shape):
 		by β-degrees is outlined in the following steps:
 
 		"""
-		# Translate the end and start points by xt = −xr and yt = −yr
-		self.translate(-x,-y)
-		x1 = self.x1
-		x2 = self.x2
-		y1 = self.y1
-		y2 = self.y2
-
-		# Rotate the translated x-values β-degrees using Equation 3.7
-		self.x1 = round(self.eq37(x1, y1, angle))
-		self.x2 = round(self.eq37(x2, y2, angle))
-		# Rotate the translated y-values β-degrees using Equation 3.8
-		self.y1 = round(self.eq38(x1, y1, angle))
-		self.y2 = round(self.eq38(x2, y2, angle))
-
-		# Translate resulting points by xt = xr and yt = yr
-		self.translate(x,y)
+		# Translate by xt = −xr and yt = −yr, rotate β-degrees using Equations 3.7 and 3.8,
+		# and translate back by xt = xr and yt = yr, as one pending Transform
+		return self.transform( Transform().rotate(x, y, angle) )
 
 	def scale(self, x, y, factor_x, factor_y):
 		"""
@@ -131,19 +184,9 @@ class Line(Shape):
 		point (xf, yf) is outlined in the following steps:
 
 		"""
-		# Translate the end and start points by xt = −xf and yt = −yf
-		self.translate(-x,-y)
-
-		# Scale the translated x-values by Sx using Equation 3.9
-		self.x1 = round(self.x1*factor_x)
-		self.x2 = round(self.x2*factor_x)
-		# Scale the translated y-values by Sy using Equation 3.10
-		self.y1 = round(self.y1*factor_y)
-		self.y2 = round(self.y2*factor_y)
-
-		# Translate resulting points by xt = xf and yt = yf
-		self.translate(x,y)
-
+		# Translate by xt = −xf and yt = −yf, scale by Sx and Sy using Equations 3.9 and 3.10,
+		# and translate back by xt = xf and yt = yf, as one pending Transform
+		return self.transform( Transform().scale(x, y, factor_x, factor_y) )
 
 	# Hacks
 	def minX(self):
@@ -159,7 +202,76 @@ class Line(Shape):
 
 
 
+# Batch Lines
+def draw_lines(endpoints, window=None):
+	"""
+	Rasterizes many lines at once. Takes an Nx4 array (or list) of (x1, y1, x2, y2)
+	endpoints, and returns an Mx2 integer array of the pixels of all the lines. The
+	pixels are the same as Line.draw_border, but found in one vectorized pass. If a
+	(min_x, min_y, max_x, max_y) window is passed, every line is clipped to it first.
+
+	"""
+	if numpy is None:
+		raise ImportError("Batch line rasterization requires numpy.")
+	if stats.enabled: began = stats.clock()
+	ends = numpy.rint(numpy.asarray(endpoints, dtype=numpy.float64).reshape(-1, 4)).astype(numpy.int64)
+	if len(ends) == 0: return numpy.empty((0, 2), dtype=numpy.int64)
+	x1, y1, x2, y2 = ends[:,0], ends[:,1], ends[:,2], ends[:,3]
+
+	# Pick the major axis a and the minor axis b of every line, like draw_border
+	long = numpy.abs(x1 - x2) > numpy.abs(y1 - y2)
+	a1 = numpy.where(long, x1, y1)
+	b1 = numpy.where(long, y1, x1)
+	a2 = numpy.where(long, x2, y2)
+	b2 = numpy.where(long, y2, x2)
+	# Always walk in increasing a
+	swap = a1 > a2
+	a1, a2 = numpy.where(swap, a2, a1), numpy.where(swap, a1, a2)
+	b1, b2 = numpy.where(swap, b2, b1), numpy.where(swap, b1, b2)
+	da = a2 - a1
+	db = b2 - b1
+
+	# Clip the walk along the major axis to the window
+	first = numpy.zeros(len(ends), dtype=numpy.int64)
+	count = da + 1
+	if window is not None:
+		min_a = numpy.where(long, window[0], window[1])
+		max_a = numpy.where(long, window[2], window[3])
+		start = numpy.maximum(a1, min_a)
+		first = start - a1
+		count = numpy.maximum(numpy.minimum(a2, max_a) - start + 1, 0)
+
+	# One row per pixel: the line it belongs to, and its step k along the major axis
+	line = numpy.repeat(numpy.arange(len(ends)), count)
+	k = numpy.arange(count.sum()) - numpy.repeat(numpy.cumsum(count) - count, count) + first[line]
+
+	# Exact minor value b1 + db*k/da as a quotient and remainder, rounded half to even
+	da_safe = numpy.maximum(da, 1)[line]
+	q, r = numpy.divmod(db[line] * k, da_safe)
+	b = b1[line] + q
+	b += (2*r > da_safe) | ((2*r == da_safe) & (b % 2 == 1))
+	a = a1[line] + k
+
+	long = long[line]
+	points = numpy.stack((numpy.where(long, a, b), numpy.where(long, b, a)), axis=1)
+	if window is not None:
+		# Drop the pixels outside of the window along the minor axis
+		points = points[ (points[:,0] >= window[0]) & (points[:,0] <= window[2]) & (points[:,1] >= window[1]) & (points[:,1] <= window[3]) ]
+	if stats.enabled:
+		stats.generated += len(points)
+		stats.record("draw_lines", began, len(points))
+	return points
+
 # Ellipse Class
+# Matrix entries this close to zero (or a stretch this close to 1) are rounding error
+EPSILON = 1e-9
+
+def stretch(factor):
+	"""Returns how much a matrix entry stretches a radius, ignoring rounding error."""
+	factor = abs(factor)
+	if abs(factor - 1) < EPSILON: return 1
+	return factor
+
 class Ellipse(Shape):
 	# Constructor
 	def __init__(self, x, y, a, b, color=Color(0,0,0)):
@@ -189,71 +301,133 @@ class Ellipse(Shape):
 			new_points.append( (point[0]+self.x, point[1]+self.y) )
 		return new_points
 
-	# Draw Functions
-	def draw_border(self):
+	def quadrant(self):
+		"""
+		A midpoint ellipse algorithm, using integer decision variables only. Returns the
+		first quadrant's points from (a, 0) to (0, b), with x never increasing and y
+		never decreasing, relative to the center.
+
+		"""
+		a = round(self.a)
+		b = round(self.b)
 		solution = []
 
 		# Initialize starting point to (a, 0): x = a and y = 0
-		x = self.a
+		x = a
 		y = 0
 		solution.append( (x,y) )
 
+		# Region 2 picks x for each y: decrement x while the midpoint (x − .5, y) is outside,
+		# d = b2(2x − 1)2 − 4a2(b2 − y2)
+		d = b*b*(2*x - 1)*(2*x - 1) - 4*a*a*(b*b - y*y)
 		# If a2(y + 1) < b2(x − .5), (In region 2)
-		while (math.pow(self.a,2) * (y + 1)) < (math.pow(self.b,2) * (x - 0.5)):
+		while 2*a*a*(y + 1) < b*b*(2*x - 1) and y < b:
 			# Compute the next y location for region 2: y + 1
+			d += 4*a*a*(2*y + 1)
 			y += 1
-			# Compute the x value (xa) for y + 1 using Equation 2.8
-			x = round(math.sqrt(math.pow(self.a,2) * (1-(1/math.pow(self.b,2))*math.pow(y,2))))
+			while d > 0 and x > 0:
+				d += b*b*(8 - 8*x)
+				x -= 1
 			solution.append( (x,y) )
+
+		# Region 1 picks y for each x: increment y while the midpoint (x, y + .5) is inside,
+		# e = 4b2(a2 − x2) − a2(2y + 1)2
+		e = 4*b*b*(a*a - x*x) - a*a*(2*y + 1)*(2*y + 1)
 		# Now in region 1
-		while(x > 0):
+		while x > 0:
 			# Compute the next x location for region 1: x − 1
+			e += 4*b*b*(2*x - 1)
 			x -= 1
-			# Compute the y location (ya) for x − 1 using Equation 2.9
-			y = round(math.sqrt(math.pow(self.b,2) * (1-(1/math.pow(self.a,2))*math.pow(x,2))))
-			solution.append( (x, y) )
-			
-		# From the discovered points in the first quadrant, find the other points by symmetry
-		solution = self.sym(solution)
-		# Add the center point (xc, yc) to all discovered points
-		solution = self.center(solution)
-		# Remove duplicates to be safe
-		solution = self.remove_duplicates(solution)
-		
+			while e >= 0 and y < b:
+				e -= a*a*(8*y + 8)
+				y += 1
+			solution.append( (x,y) )
+
+		# A narrow ellipse can reach x = 0 in region 2, so finish the column up to (0, b)
+		while y < b:
+			y += 1
+			solution.append( (x,y) )
+
+		return solution
+
+	def geometry(self):
+		return [ (self.x, self.y) ], (self.a, self.b)
+	def bounds(self):
+		ellipse = self.transformed()
+		xc, yc, a, b = round(ellipse.x), round(ellipse.y), round(ellipse.a), round(ellipse.b)
+		return (xc - a, yc - b, xc + a, yc + b)
+
+	def extents(self, points):
+		"""Finds the half-width of every row 0...b directly from a quadrant's points."""
+		solution = []
+		for x, y in points:
+			# The first point reaching a row is its widest, rows skipped over take its x
+			while len(solution) <= y:
+				solution.append(x)
+		return solution
+
+	# Draw Functions
+	def draw_border(self, window=None):
+		solution = []
+		xc = round(self.x)
+		yc = round(self.y)
+
+		# From the discovered points in the first quadrant, find the other points by symmetry,
+		# and add the center point (xc, yc). Points on an axis only mirror once.
+		for x, y in self.quadrant():
+			solution.append( (xc+x, yc+y) )
+			if x != 0: solution.append( (xc-x, yc+y) )
+			if y != 0: solution.append( (xc+x, yc-y) )
+			if x != 0 and y != 0: solution.append( (xc-x, yc-y) )
+
+		if window is not None: solution = clip_points(solution, window)
 		return solution
 
 	def draw_inside(self):
+		return spans_to_points(self.draw_spans())
+
+	def draw_spans(self, window=None):
 		solution = []
+		xc = round(self.x)
+		yc = round(self.y)
 
-		# Find the absolute boundaries of the primitive
-		self.border = self.draw_border()
-		min_y = min(y[1] for y in self.border)
-		max_y = max(y[1] for y in self.border)
-		# For each row of the primitive, find the boundary pixels
-		for row in range( min_y, max_y ):
-			bound_min = min((y for y in self.border if y[1]==row), key=operator.itemgetter(0))
-			bound_max = max((y for y in self.border if y[1]==row), key=operator.itemgetter(0))
-			# For each row, fill in the pixels between boundary pixels
-			solution.extend( Line(bound_min[0], bound_min[1], bound_max[0], bound_max[1]).draw() )
+		# For each row, fill in the pixels between the boundary pixels
+		extents = self.extents(self.quadrant())
+		for y in range(len(extents)-1, 0, -1):
+			solution.append( (yc-y, xc-extents[y], xc+extents[y]) )
+		for y in range(len(extents)):
+			solution.append( (yc+y, xc-extents[y], xc+extents[y]) )
 
+		if window is not None: solution = clip_spans(solution, window)
 		return solution
 
 	# Transformations
-	def translate(self, x, y):
-		self.x += x
-		self.y += y
-
-	def rotate(self, x, y, angle):
-		# One possible way this could work is forming a line from the center of the ellipse
-		# to one of the border points. Then you apply your standard line rotation with the
-		# center point being the rotation point. Unfortunately, you literally have to do this
-		# for every single border point. 
-		raise NotImplementedError
+	def axes(self, matrix):
+		"""
+		Returns the (a, b) radii of the ellipse after a Transform, or None if the Transform
+		would turn its axes off of the x and y-axes. Circles can be rotated by any angle,
+		ellipses only by quarter turns.
 
-	def scale(self, x, y, factor_x, factor_y):
-		# This only scales on the center point.
-		self.a *= factor_x
-		self.b *= factor_y
+		"""
+		(a, b, c), (d, e, f), _ = matrix.matrix
+		if abs(b) < EPSILON and abs(d) < EPSILON:
+			return self.a * stretch(a), self.b * stretch(e)
+		if abs(a) < EPSILON and abs(e) < EPSILON:
+			# A quarter turn swaps the axes
+			return self.b * stretch(b), self.a * stretch(d)
+		if self.a == self.b and abs(a*b + d*e) < EPSILON and abs(math.hypot(a, d) - math.hypot(b, e)) < EPSILON:
+			# A circle stays a circle, only its center moves
+			return self.a * stretch(math.hypot(a, d)), self.b * stretch(math.hypot(b, e))
+		return None
+	def transform(self, matrix):
+		"""Lazily transforms an ellipse, like Shape.transform, rejecting any Transform that would turn its axes."""
+		pending = matrix if self.matrix is None else matrix * self.matrix
+		if self.axes(pending) is None:
+			raise NotImplementedError("Ellipses can only be rotated by quarter turns, and not sheared. Circles can be rotated by any angle.")
+		return super(Ellipse, self).transform(matrix)
+	def apply_matrix(self, matrix):
+		self.a, self.b = self.axes(matrix)
+		(self.x, self.y), = matrix.apply( [(self.x, self.y)] )
 
 
 
@@ -265,6 +439,45 @@ class Circle(Ellipse):
 	def __init__(self, x, y, r, color=Color(0,0,0)):
 		super(Circle, self).__init__(x,y,r,r,color)
 
+	def quadrant(self):
+		"""
+		A midpoint circle algorithm. Only the octant from (r, 0) to the diagonal is
+		walked, and the rest of the quadrant is found by swapping x and y.
+
+		"""
+		if round(self.a) != round(self.b):
+			# Scaled unevenly, so this is no longer a circle
+			return super(Circle, self).quadrant()
+		r = round(self.a)
+		# column[y] is the circle's x for row y, rounded like Ellipse.quadrant
+		column = []
+
+		# Initialize starting point to (r, 0), d = (2x − 1)2 − 4(r2 − y2)
+		x = r
+		y = 0
+		d = (2*x - 1)*(2*x - 1) - 4*r*r
+		column.append(x)
+		top = None
+		while True:
+			# The first octant ends where region 2 of the ellipse would: a2(y + 1) >= b2(x − .5)
+			if top is None and 2*(y + 1) >= 2*x - 1:
+				top = y
+				end_x = x
+			# Keep walking up to row end_x − 1, so the swapped octant has every column it needs
+			if top is not None and y >= end_x - 1: break
+			d += 4*(2*y + 1)
+			y += 1
+			# Decrement x while the midpoint (x − .5, y) is outside
+			while d > 0 and x > 0:
+				d += 8 - 8*x
+				x -= 1
+			column.append(x)
+
+		# The first octant is (column[y], y), the second is the same points with x and y swapped
+		solution = [ (column[y], y) for y in range(top + 1) ]
+		solution.extend( (x, column[x]) for x in range(end_x - 1, -1, -1) )
+		return solution
+
 
 
 
@@ -285,7 +498,7 @@ class Polygon(Shape):
 		return self.getSlope(x1, y1, x2, y2)*y - self.getSlope(x1, y1, x2, y2)*y1 + x1
 
 	# Draw Functions
-	def draw_border(self):
+	def draw_border(self, window=None):
 		# A simple polygon algorithm is outlined in the following steps for n vertex
 		# points [(x1, y1), (x2, y2), ..., (xn, yn)], listed in the order to be connected:
 		solution = []
@@ -295,13 +508,13 @@ class Polygon(Shape):
 			y1 = self.point_list[i][1]
 			x2 = self.point_list[i+1][0]
 			y2 = self.point_list[i+1][1]
-			solution.extend( Line(x1, y1, x2, y2).draw() )
+			solution.extend( Line(x1, y1, x2, y2).draw_border(window) )
 		# 2. Use the line algorithm in section 2.1 to draw a line between the last point in the list and the first point
 		x1 = self.point_list[0][0]
 		y1 = self.point_list[0][1]
 		x2 = self.point_list[len(self.point_list)-1][0]
 		y2 = self.point_list[len(self.point_list)-1][1]
-		solution.extend( Line(x1, y1, x2, y2).draw() )
+		solution.extend( Line(x1, y1, x2, y2).draw_border(window) )
 		solution = self.remove_duplicates(solution)
 		return solution
 
@@ -340,71 +553,257 @@ class Polygon(Shape):
 
 		return solution
 
-	def draw_inside(self):
-		point_pairs = []
-		solution = []
+	def geometry(self):
+		return self.point_list, ()
+	def bounds(self):
+		points = [ (round(point[0]), round(point[1])) for point in self.transformed().point_list ]
+		return (min(x for x, y in points), min(y for x, y in points), max(x for x, y in points), max(y for x, y in points))
 
-		# Find the min y-value (ymin) and the max y-value (ymax)
-		min_y = min(y[1] for y in self.point_list)
-		max_y = max(y[1] for y in self.point_list)
-
-		# Use the scan-line intersection algorithm to find intersections
-		for a in range(min_y+1, max_y): # min_y+1 to get throw away single bottom point, range throws away max_y
-			tmp = self.scan_line(a)
-			# sort intersections from minimal to maximal value based on the x values
-			tmp.sort( key=operator.itemgetter(0) ) 
-			if len(tmp) > 0: point_pairs.extend( tmp ) 
-
-		# If there are intersections
-		if len(point_pairs) > 0:
-			# Fill in pixels between adjacent pairs of intersection points
-			for i in range(0, len(point_pairs)-1, 2):
-				solution.extend( Line(point_pairs[i][0], point_pairs[i][1], point_pairs[i+1][0], point_pairs[i+1][1]).draw() )	
+	def edge_table(self):
+		"""
+		Builds the edge table for the polygon: one [y_low, y_high, x_low, dx, dy] entry per
+		non-horizontal edge, oriented so dy > 0, and sorted by y_low.
 
-		return solution
+		"""
+		table = []
+		points = [ (round(point[0]), round(point[1])) for point in self.point_list ]
+		for i in range(len(points)):
+			x1, y1 = points[i]
+			x2, y2 = points[(i+1)%len(points)]
+			# This is a horizontal line, so there is never an intersection
+			if y1 == y2: continue
+			if y1 > y2: x1, y1, x2, y2 = x2, y2, x1, y1
+			table.append( [y1, y2, x1, x2 - x1, y2 - y1] )
+		table.sort( key=operator.itemgetter(0) )
+		return table
 
-	# Transformations
-	def translate(self, x, y):
-		tmp_list = []
-		for point in self.point_list:
-			tmp_list.append( (point[0]+x, point[1]+y) )
-		self.point_list = tmp_list
-	
-	def rotate(self, x, y, angle):
-		tmp_point_list = []
-		for i in range(len(self.point_list)):
+	def draw_inside(self):
+		return spans_to_points(self.draw_spans())
 
-			# Two vertex points to local vars
-			x1 = self.point_list[i][0]
-			y1 = self.point_list[i][1]
-			x2 = self.point_list[(i+1)%len(self.point_list)][0]
-			y2 = self.point_list[(i+1)%len(self.point_list)][1]
+	def draw_spans(self, window=None):
+		"""
+		An active edge table scan-line fill. The edges are sorted once by their lowest
+		y-value. Each scan line y = a adds the edges that start below it, drops the edges
+		whose maximal vertex point it has reached, and steps the x-intercepts of the rest
+		with integer adds. Intersections are rounded half to even, like Equation 2.4.
+		With a window, only its scan lines are visited, and the spans are clamped to it.
 
-			# Preform rotation on temporary line 
-			tmp_line = Line(x1, y1, x2, y2)
-			tmp_line.rotate(x, y, angle)
+		"""
+		solution = []
+		table = self.edge_table()
+		if len(table) == 0: return solution
 
-			# Rotated points back to point list
-			tmp_point_list.append((tmp_line.x1, tmp_line.y1))
-		self.point_list = tmp_point_list
+		# Find the min y-value (ymin) and the max y-value (ymax)
+		min_y = table[0][0]
+		max_y = max(edge[1] for edge in table)
+		rows = range(min_y+1, max_y) # min_y+1 to get throw away single bottom point, range throws away max_y
+		if window is not None: rows = range(max(rows.start, window[1]), min(rows.stop, window[3]+1))
+
+		# Active edges: [y_high, x, r, step_x, step_r, dy], exact x-intercept is x + r/dy
+		active = []
+		next_edge = 0
+		for a in rows:
+			# Add the edges that start at or below the scan line
+			while next_edge < len(table) and table[next_edge][0] <= a:
+				y_low, y_high, x_low, dx, dy = table[next_edge]
+				q, r = divmod(dx * (a - y_low), dy)
+				step_x, step_r = divmod(dx, dy)
+				active.append( [y_high, x_low + q, r, step_x, step_r, dy] )
+				next_edge += 1
+			# The scan line intersects a maximal vertex-point, so there is not an intersection
+			active = [ edge for edge in active if edge[0] > a ]
+
+			# Round every intersection, and sort them from minimal to maximal x
+			x_vals = []
+			for edge in active:
+				x, r, dy = edge[1], edge[2], edge[5]
+				if 2*r > dy or (2*r == dy and x % 2): x += 1
+				x_vals.append(x)
+				# Step the intercept to the next scan line
+				edge[1] += edge[3]
+				edge[2] += edge[4]
+				if edge[2] >= dy:
+					edge[2] -= dy
+					edge[1] += 1
+			x_vals.sort()
 
-	
-	def scale(self, x, y, factor_x, factor_y):
-		tmp_point_list = []
-		for i in range(len(self.point_list)):
-			# Two vertex points to local vars
-			x1 = self.point_list[i][0]
-			y1 = self.point_list[i][1]
-			x2 = self.point_list[(i+1)%len(self.point_list)][0]
-			y2 = self.point_list[(i+1)%len(self.point_list)][1]
+			# Fill in pixels between adjacent pairs of intersection points
+			for i in range(0, len(x_vals)-1, 2):
+				solution.append( (a, x_vals[i], x_vals[i+1]) )
 
-			# Preform rotation on temporary line 
-			tmp_line = Line(x1, y1, x2, y2)
-			tmp_line.scale(x, y, factor_x, factor_y)
+		if window is not None: solution = clip_spans(solution, window)
+		return solution
 
-			# Rotated points back to point list
-			tmp_point_list.append((tmp_line.x1, tmp_line.y1))
-		self.point_list = tmp_point_list
+	# Transformations
+	def apply_matrix(self, matrix):
+		self.point_list = matrix.apply(self.point_list)
 
 	def scale_eq(self, x, y, factor):
-		self.scale(x, y, factor, factor)
\ No newline at end of file
+		return self.scale(x, y, factor, factor)
+
+
+
+# Reference Rasterizers
+# The book's algorithms, per point and in exact arithmetic (rounding half to even), that
+# the incremental rasterizers are tested against.
+def line_reference(x1, y1, x2, y2):
+	"""Every point of a line: for each integer on the longer axis, the exact other value, rounded."""
+	if abs(x1 - x2) > abs(y1 - y2):
+		return set( (x, round(y1 + Fraction((x - x1)*(y2 - y1), x2 - x1))) for x in range(min(x1,x2), max(x1,x2)+1) )
+	if y1 == y2: return set([ (x1, y1) ])
+	return set( (round(x1 + Fraction((y - y1)*(x2 - x1), y2 - y1)), y) for y in range(min(y1,y2), max(y1,y2)+1) )
+
+def polygon_reference(point_list):
+	"""The spans of a polygon, from scan_line's intersections for every row, in exact arithmetic."""
+	solution = []
+	ys = [ point[1] for point in point_list ]
+	for a in range(min(ys)+1, max(ys)):
+		x_vals = []
+		for i in range(len(point_list)):
+			(x1, y1), (x2, y2) = point_list[i], point_list[(i+1)%len(point_list)]
+			if y1 == y2 or not (min(y1,y2) <= a < max(y1,y2)): continue
+			x_vals.append( round(x1 + Fraction((a - y1)*(x2 - x1), y2 - y1)) )
+		x_vals.sort()
+		solution.extend( (a, x_vals[i], x_vals[i+1]) for i in range(0, len(x_vals)-1, 2) )
+	return solution
+
+def round_sqrt(value):
+	"""Rounds the square root of a Fraction, half to even, exactly."""
+	root = math.isqrt(value.numerator // value.denominator)
+	tie = Fraction(2*root + 1, 2)**2
+	if value > tie or (value == tie and root % 2): return root + 1
+	return root
+
+def quadrant_reference(a, b):
+	"""The first quadrant of an ellipse, from Equations 2.8 and 2.9 in exact arithmetic."""
+	x, y = a, 0
+	solution = [ (x, y) ]
+	# Region 2
+	while a*a*(y + 1) < b*b*(x - Fraction(1, 2)) and y < b:
+		y += 1
+		x = round_sqrt(a*a*(1 - Fraction(y*y, b*b)))
+		solution.append( (x, y) )
+	# Region 1
+	while x > 0:
+		x -= 1
+		y = round_sqrt(b*b*(1 - Fraction(x*x, a*a)))
+		solution.append( (x, y) )
+	while y < b:
+		y += 1
+		solution.append( (x, y) )
+	return solution
+
+# Unit Tests
+def unit_test1():
+	"""Testing the integer line algorithm, with and without clipping"""
+	rand = random.Random(1)
+	window = (-10, -15, 20, 5)
+	for i in range(2000):
+		x1, y1, x2, y2 = [ rand.randint(-40, 40) for j in range(4) ]
+		border = Line(x1, y1, x2, y2).draw_border()
+		assert(len(border) == len(set(border)))
+		assert(set(border) == line_reference(x1, y1, x2, y2))
+		assert(set(Line(x1, y1, x2, y2).draw_border(window)) == set(clip_points(border, window)))
+
+def unit_test2():
+	"""Testing batch line rasterization against Line.draw_border"""
+	if numpy is None: return
+	rand = random.Random(2)
+	window = (-10, -15, 20, 5)
+	endpoints = [ [ rand.randint(-40, 40) for j in range(4) ] for i in range(500) ]
+	border = [ point for line in endpoints for point in Line(*line).draw_border() ]
+	assert(sorted(map(tuple, draw_lines(endpoints).tolist())) == sorted(border))
+	assert(sorted(map(tuple, draw_lines(endpoints, window).tolist())) == sorted(clip_points(border, window)))
+
+def unit_test3():
+	"""Testing the active edge table fill, with and without clipping"""
+	rand = random.Random(3)
+	window = (-10, -15, 20, 5)
+	for i in range(1000):
+		point_list = [ (rand.randint(-30, 30), rand.randint(-30, 30)) for j in range(rand.randint(3, 9)) ]
+		spans = Polygon(point_list).draw_spans()
+		assert(spans == polygon_reference(point_list))
+		assert(Polygon(point_list).draw_spans(window) == clip_spans(spans, window))
+
+def unit_test4():
+	"""Testing the midpoint ellipse and circle algorithms, and the ellipse fill"""
+	for a in range(1, 40):
+		for b in range(1, 40):
+			ellipse = Ellipse(3, -2, a, b)
+			quadrant = ellipse.quadrant()
+			assert(quadrant == quadrant_reference(a, b))
+			# Every row is filled to the widest point of the quadrant at or above it
+			spans = [ (y - 2, 3 - max(x for x, top in quadrant if top >= abs(y)), 3 + max(x for x, top in quadrant if top >= abs(y))) for y in range(-b, b+1) ]
+			assert(sorted(ellipse.draw_spans()) == spans)
+	for r in range(200):
+		assert(Circle(0, 0, r).quadrant() == Ellipse(0, 0, r, r).quadrant())
+	# Scaling goes through the pending Transform, so the fixed point stays put
+	ellipse = Ellipse(10, 20, 4, 6).scale(0, 0, 2, 3).apply()
+	assert((ellipse.x, ellipse.y, ellipse.a, ellipse.b) == (20, 60, 8, 18))
+	ellipse = Circle(10, 20, 4).scale_eq(10, 20, 2.5).translate(1, 1).apply()
+	assert((ellipse.x, ellipse.y, ellipse.a, ellipse.b) == (11, 21, 10, 10))
+
+def unit_test5():
+	"""Testing that cached points are the same as calculated ones, and that the raster cache stays under max_bytes"""
+	rand = random.Random(5)
+	def make():
+		x, y = rand.randint(-50, 50), rand.randint(-50, 50)
+		kind = rand.randrange(4)
+		if kind == 0: return Line(x, y, rand.randint(-50, 50), rand.randint(-50, 50))
+		if kind == 1: return Circle(x, y, rand.randint(0, 30)).fill()
+		if kind == 2: return Ellipse(x, y, rand.randint(0, 30), rand.randint(0, 30)).fill()
+		return Polygon([ (rand.randint(-50, 50), rand.randint(-50, 50)) for i in range(rand.randint(3, 7)) ]).fill()
+	def change(shape):
+		# Odd and even offsets, and every transformation
+		dx, dy = rand.randint(-9, 9), rand.randint(-9, 9)
+		kind = rand.randrange(4)
+		if kind == 0: return shape.translate(dx, dy)
+		if kind == 1: return shape.rotate(dx, dy, rand.choice([90, 180, 270]) if type(shape) == Ellipse else rand.randrange(360))
+		if kind == 2: return shape.scale(dx, dy, 2, 2)
+		return shape.move(dx, dy)
+	def points(shape):
+		shape.draw()
+		return sorted(shape.border), sorted(shape.spans)
+	saved = raster_cache.max_bytes
+	try:
+		for i in range(500):
+			shapes = [ make() ]
+			for j in range(3): shapes.append( change(copy.deepcopy(shapes[-1])) )
+			raster_cache.max_bytes = 0
+			expected = [ points(copy.deepcopy(shape)) for shape in shapes ]
+			raster_cache.max_bytes = saved
+			# Twice, so the second time every shape's points come out of the cache
+			for k in range(2):
+				assert([ points(copy.deepcopy(shape)) for shape in shapes ] == expected)
+			# Drawn and then changed, on the same shape
+			shape = copy.deepcopy(shapes[0])
+			points(shape)
+			for j in range(3):
+				assert(points(change(shape)) == points(copy.deepcopy(shape).apply()))
+		# The least recently used points are forgotten first, to stay under max_bytes
+		cache = RasterCache(RasterCache.point_bytes * 100)
+		for i in range(50):
+			cache.put(i, [ (0, 0) ] * 10, [])
+			assert(cache.get(0) is not None)
+			assert(cache.size <= cache.max_bytes)
+			assert(cache.size == sum( entry[2] for entry in cache.entries.values() ))
+		assert(len(cache) == 10 and cache.get(1) is None and cache.get(49) is not None)
+		# Points bigger than the whole cache are never stored
+		cache.put("big", [ (0, 0) ] * 101, [])
+		assert(cache.get("big") is None and len(cache) == 10)
+		raster_cache.clear()
+		raster_cache.max_bytes = RasterCache.point_bytes * 1000
+		for i in range(200):
+			points(make())
+			assert(raster_cache.size <= raster_cache.max_bytes)
+	finally:
+		raster_cache.max_bytes = saved
+		raster_cache.clear()
+
+# Main
+if __name__ == "__main__":
+	unit_test1()
+	unit_test2()
+	unit_test3()
+	unit_test4()
+	unit_test5()
@@ -7,26 +7,43 @@
 
 # Imports 
 import math
+import numbers
+import random
 from GeoPrimitives import Image
 from GeoPrimitives import Line
+from Stats import stats
+
+# Optional Imports
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# A typical distance for the near plane in front of the center of projection. Clipping
+# to a near plane is opt-in.
+NEAR = 1
 
 # Point 3D
 class Point3D:
 	# Constructor
 	def __init__(self, point):
 		self.point = point # 3-tuple
-		print(point)
+		stats.debug(point)
 
 	# Equations
 	def eq(self, xya, za, d):
 		"""Works for Equation 4.1 and 4.2."""
+		if za == 0:
+			raise ZeroDivisionError("Vertex point %s is at the center of projection." % str(self.point))
 		return (xya/za) * d
 
 	# Method
 	def get_2D_point(self, d):
 		"""Returns a 2-tuple 2D point from a passed d."""
+		if stats.enabled: start = stats.clock()
 		x = self.eq(self.point[0], self.point[2], d)
 		y = self.eq(self.point[1], self.point[2], d)
+		if stats.enabled: stats.record("projection", start, 1)
 		return x,y
 
 # Line 3D
@@ -53,13 +70,188 @@ class Line3D:
 		# Return a 2D line object
 		return Line(x1, y1, x2, y2, (255, 0, 0))
 
+	def clip(self, d, near):
+		"""Returns the part of the line in front of the near plane as a new Line3D, or None if there isn't any."""
+		segment = clip_near(self.start_pt.point, self.end_pt.point, d, near)
+		if segment is None: return None
+		if segment == (self.start_pt.point, self.end_pt.point): return self
+		return Line3D(*segment)
+
+	def hull(self):
+		"""Returns points whose convex hull holds the whole line."""
+		return [ self.start_pt.point, self.end_pt.point ]
+
+# View Volume
+def depth(point, d):
+	"""How far an aligned point is in front of the center of projection, towards the view plane at z = d."""
+	if d < 0: return -point[2]
+	return point[2]
+
+def clip_near(start, end, d, near):
+	"""
+	Clips an aligned 3D segment to the near plane, near in front of the center of
+	projection. Returns the (start, end) points in front of it, or None.
+
+	"""
+	s1 = depth(start, d)
+	s2 = depth(end, d)
+	if s1 >= near and s2 >= near: return (start, end)
+	if s1 < near and s2 < near: return None
+	# Move the end point that is behind the near plane onto it
+	t = (near - s1) / (s2 - s1)
+	point = tuple( start[i] + t * (end[i] - start[i]) for i in range(3) )
+	if s1 < near: return (point, end)
+	return (start, point)
+
+def culled(points, d, near, frustum=None):
+	"""
+	Checks if the convex hull of some aligned points (like the corners of a bounding box)
+	is entirely outside of the view volume: behind the near plane, or, if a
+	(min_x, min_y, max_x, max_y) frustum window on the view plane is passed, outside
+	of one of its sides.
+
+	"""
+	depths = [ depth(point, d) for point in points ]
+	if near is not None and all(s < near for s in depths): return True
+	# The sides only hold in front of the center of projection, so other hulls are culled edge by edge instead
+	if frustum is not None and all(s > 0 for s in depths):
+		# A point projects inside of a side, like x*d/z >= min_x, when x*|d| − min_x*depth >= 0
+		ad = abs(d)
+		min_x, min_y, max_x, max_y = frustum
+		if all(p[0]*ad < min_x*s for p, s in zip(points, depths)): return True
+		if all(p[0]*ad > max_x*s for p, s in zip(points, depths)): return True
+		if all(p[1]*ad < min_y*s for p, s in zip(points, depths)): return True
+		if all(p[1]*ad > max_y*s for p, s in zip(points, depths)): return True
+	return False
+
+def outside(x1, y1, x2, y2, frustum):
+	"""Checks if projected 2D line endpoints are entirely outside of one side of a (min_x, min_y, max_x, max_y) frustum window."""
+	min_x, min_y, max_x, max_y = frustum
+	return (x1 < min_x and x2 < min_x) or (x1 > max_x and x2 > max_x) or (y1 < min_y and y2 < min_y) or (y1 > max_y and y2 > max_y)
+
+# Mesh
+class Mesh:
+	"""
+	An indexed wire-frame: a list of shared 3D vertex points, and a list of edges as
+	(start, end) index pairs into it. A vertex shared by many edges is stored, aligned,
+	and projected only once.
+
+	"""
+	# Constructor
+	def __init__(self, vertices, edges):
+		self.vertices = vertices
+		self.edges = edges
+
+	@classmethod
+	def from_lines(cls, lines):
+		"""Builds a mesh from a list of (start point, end point) 3D lines, merging shared vertex points."""
+		index = {}
+		vertices = []
+		edges = []
+		for line in lines:
+			edge = []
+			for point in line:
+				point = tuple(point)
+				if point not in index:
+					index[point] = len(vertices)
+					vertices.append(point)
+				edge.append(index[point])
+			edges.append( tuple(edge) )
+		return cls(vertices, edges)
+
+	# Equations
+	def align(self, vrp, cop, u, v, n):
+		"""Returns a new mesh with every vertex aligned once, using ArbitAlign."""
+		if numpy is not None:
+			vertices = numpy.asarray(self.vertices, dtype=numpy.float64).reshape(-1, 3)
+			return Mesh(align_vertices(vertices, vrp, cop, u, v, n), self.edges)
+		return Mesh(ArbitAlign(self.vertices).align(vrp, cop, u, v, n), self.edges)
+
+	def hull(self):
+		"""Returns the corners of the mesh's bounding box, whose convex hull holds the whole mesh."""
+		if numpy is not None:
+			vertices = numpy.asarray(self.vertices, dtype=numpy.float64).reshape(-1, 3)
+			low, high = vertices.min(axis=0).tolist(), vertices.max(axis=0).tolist()
+		else:
+			low = [ min(vertex[i] for vertex in self.vertices) for i in range(3) ]
+			high = [ max(vertex[i] for vertex in self.vertices) for i in range(3) ]
+		return [ (x, y, z) for x in (low[0], high[0]) for y in (low[1], high[1]) for z in (low[2], high[2]) ]
+
+	def project(self, d, near=None, frustum=None):
+		"""
+		Projects the mesh onto a view plane at z = d, and returns a 2D line object per edge.
+		If a near plane distance is passed, edges are clipped to it first, and edges
+		entirely behind it are dropped. If a frustum window is passed, edges entirely
+		outside of one of its sides are dropped too.
+
+		"""
+		if numpy is not None:
+			return [ Line(x1, y1, x2, y2, (255, 0, 0)) for x1, y1, x2, y2 in cull_endpoints(self.endpoints(d, near), frustum).tolist() ]
+		# Project every vertex in front of the near plane once
+		points = {}
+		for i, vertex in enumerate(self.vertices):
+			if near is None or depth(vertex, d) >= near:
+				points[i] = Point3D(vertex).get_2D_point(d)
+		lines = []
+		for start, end in self.edges:
+			if start in points and end in points:
+				(x1, y1), (x2, y2) = points[start], points[end]
+			else:
+				segment = clip_near(self.vertices[start], self.vertices[end], d, near)
+				if segment is None: continue
+				(x1, y1), (x2, y2) = Point3D(segment[0]).get_2D_point(d), Point3D(segment[1]).get_2D_point(d)
+			if frustum is not None and outside(x1, y1, x2, y2, frustum): continue
+			lines.append( Line(x1, y1, x2, y2, (255, 0, 0)) )
+		return lines
+
+	def endpoints(self, d, near=None):
+		"""
+		Projects the mesh onto a view plane at z = d, and returns an Nx4 array of the edges'
+		endpoints. If a near plane distance is passed, edges are clipped to it first, and
+		edges entirely behind it are dropped.
+
+		"""
+		vertices = numpy.asarray(self.vertices, dtype=numpy.float64).reshape(-1, 3)
+		edges = numpy.asarray(self.edges, dtype=numpy.intp).reshape(-1, 2)
+		if near is None:
+			return project_vertices(vertices, d)[edges].reshape(-1, 4)
+
+		# Project every vertex in front of the near plane once
+		depths = vertices[:,2] if d >= 0 else -vertices[:,2]
+		front = depths >= near
+		points = numpy.zeros((len(vertices), 2))
+		points[front] = project_vertices(vertices[front], d)
+		endpoints = points[edges]
+
+		# Edges with one end point behind the near plane are clipped to it
+		front = front[edges]
+		cross = front[:,0] != front[:,1]
+		if cross.any():
+			starts, ends = vertices[edges[cross,0]], vertices[edges[cross,1]]
+			s1, s2 = depths[edges[cross,0]], depths[edges[cross,1]]
+			t = (near - s1) / (s2 - s1)
+			clipped = project_vertices(starts + t[:,None] * (ends - starts), d)
+			behind = ~front[cross]
+			crossed = endpoints[cross]
+			crossed[behind] = clipped.repeat(2, axis=0).reshape(-1, 2, 2)[behind]
+			endpoints[cross] = crossed
+		return endpoints[ front.any(axis=1) ].reshape(-1, 4)
+
 # World 3D
 class World3D:
 	# Constructor
 	def __init__(self):
 		self.object_list = []
+		# Projected 2D line endpoints, keyed on the view parameters
+		self.cache = {}
+		self.cache_size = 16
+		# View volume: the near plane distance, and an optional (min_x, min_y, max_x, max_y) window on the view plane
+		self.near = None
+		self.frustum = None
 	def add(self, an_object):
 		self.object_list.append( an_object )
+		# The environment changed, so every cached projection is stale
+		self.cache.clear()
 
 	def get_center(self, lines):
 		min_x = min(x.minX() for x in lines)
@@ -70,6 +262,70 @@ class World3D:
 		yc = (max_y + min_y) / 2
 		return (xc, yc)
 
+	def mesh(self):
+		"""Returns the whole environment as one Mesh, keeping the order of the objects."""
+		vertices = []
+		edges = []
+		for an_object in self.object_list:
+			offset = len(vertices)
+			if isinstance(an_object, Mesh):
+				vertices.extend( tuple(vertex) for vertex in an_object.vertices )
+				edges.extend( (start + offset, end + offset) for start, end in an_object.edges )
+			else:
+				vertices.extend( [an_object.start_pt.point, an_object.end_pt.point] )
+				edges.append( (offset, offset + 1) )
+		return Mesh(vertices, edges)
+
+	def project(self, d, view=None):
+		"""
+		Projects every object onto a view plane at z = d, after aligning it to a
+		view = (VRP, CoP, ~u, ~v, ~n) if one is passed. Objects outside of the view
+		volume are culled, and lines are clipped to the near plane (if one is set). Returns the 2D lines'
+		endpoints, as an Nx4 array with numpy, or as a list of 4-tuples without.
+
+		"""
+		if numpy is not None:
+			visible = World3D()
+			for an_object in self.object_list:
+				# Single lines are culled with the rest of the edges, after projection
+				if isinstance(an_object, Mesh) and self.culled(an_object, d, view): continue
+				visible.object_list.append(an_object)
+			if len(visible.object_list) == 0: return numpy.zeros((0, 4))
+			mesh = visible.mesh()
+			if view is not None: mesh = mesh.align(*view)
+			return cull_endpoints(mesh.endpoints(d, self.near), self.frustum)
+		endpoints = []
+		for line_3D in self.object_list:
+			stats.debug(line_3D)
+			if self.culled(line_3D, d, view): continue
+			if view is not None:
+				if isinstance(line_3D, Mesh): line_3D = line_3D.align(*view)
+				else: line_3D = Line3D( *ArbitAlign([line_3D.start_pt.point, line_3D.end_pt.point]).align(*view) )
+			if isinstance(line_3D, Mesh): lines = line_3D.project(d, self.near, self.frustum)
+			else:
+				if self.near is not None: line_3D = line_3D.clip(d, self.near)
+				if line_3D is None: continue
+				lines = [ line_3D.project(d) ]
+				# Single lines are culled after projection, like the edges of a mesh
+				if self.frustum is not None and outside(lines[0].x1, lines[0].y1, lines[0].x2, lines[0].y2, self.frustum): continue
+			endpoints.extend( (line.x1, line.y1, line.x2, line.y2) for line in lines )
+		return endpoints
+
+	def culled(self, an_object, d, view=None):
+		"""Checks if an object is entirely outside of the view volume, from the convex hull of its points."""
+		hull = an_object.hull()
+		if view is not None: hull = ArbitAlign(hull).align(*view)
+		return culled(hull, d, self.near, self.frustum)
+
+	def projected(self, key, d, view=None):
+		"""Returns the cached projection for key, projecting (and caching) it first if needed."""
+		if key not in self.cache:
+			if len(self.cache) >= self.cache_size:
+				# Forget the oldest view
+				del self.cache[ next(iter(self.cache)) ]
+			self.cache[key] = self.project(d, view)
+		return self.cache[key]
+
 	def display(self, d, translate, scale):
 		"""
 		For a translation location at (xL, yL) and a scale factor of sf, a simple
@@ -78,37 +334,51 @@ class World3D:
 
 		"""
 		
-		# 3D to 2D Lines
-		tmp_lines = []
-		for line_3D in self.object_list:
-			print(line_3D)
-			tmp_lines.append( line_3D.project(d) )
+		# 3D to 2D Lines, projected once for each d until the environment changes
+		return self.show(self.projected( ('display', d, self.near, self.frustum), d ), translate, scale)
+
+	def show(self, endpoints, translate, scale):
+		"""Displays projected 2D line endpoints as 2D lines, using the display algorithm from section 4.3."""
+		if numpy is not None:
+			return [ Line(x1, y1, x2, y2, (255, 0, 0)) for x1, y1, x2, y2 in display_endpoints(endpoints, translate, scale).tolist() ]
+		tmp_lines = [ Line(x1, y1, x2, y2, (255, 0, 0)) for x1, y1, x2, y2 in endpoints ]
+		# Everything was culled
+		if len(tmp_lines) == 0: return tmp_lines
+		if stats.enabled: start = stats.clock()
 		# 1. Find the center of the 2D points using Equations 4.3 and 4.4.
 		xc, yc = self.get_center(tmp_lines)
 		# 2. Translate the start and end points of each line using the translation algorithm in
 		# section 3.1, where xt and yt are found from Equations 4.5 and 4.6
-		for line in tmp_lines: 
-			line.translate(translate[0]-xc, translate[1]-yc)
 		# 3. Scale the translated start and end points from Step 2 by Sx = sf and Sy = sf for a fix point of (xL, yL) 
 		# using the scale algorithm in section 3.3.
-		for line in tmp_lines: 
-			line.scale_eq(translate[0], translate[1], scale)
+		# Both are done on the endpoints here, since Line.translate and Line.scale are only applied when drawn
+		def display_x(x): return round(((x + (translate[0] - xc)) - translate[0]) * scale) + translate[0]
+		def display_y(y): return round(((y + (translate[1] - yc)) - translate[1]) * scale) + translate[1]
+		for line in tmp_lines:
+			line.x1, line.y1, line.x2, line.y2 = display_x(line.x1), display_y(line.y1), display_x(line.x2), display_y(line.y2)
+		if stats.enabled: stats.record("display", start, len(tmp_lines))
 		# 4. Find the points between each start and end point using the line algorithm in section 2.1
-		#for line in tmp_lines:
-		#	print(line)
 		return tmp_lines
 
-	def finish(self):
-		# 1. Find the view reference coordinate system = [~u,~v, ~n] for α and β using the 3D view algorithm in
-		#    section 4.4
-
-		# 2. Align the 3D environment to the standard view for the VRP, CoP, and [~u,~v, ~n] using the 3D
-		#    view-alignment algorithm in section 4.5.
+	def finish(self, a, b, vrp, cop, translate, scale):
+		"""
+		Views the environment for α, β, VRP, and CoP, and displays it. Everything up to the
+		projection is cached for those view parameters, so only the display step is redone
+		for a new translate or scale.
 
-		# 3. Project the vertex points to the view plane at z = −dn using the projection algorithm in section 4.2.
+		"""
+		key = ('view', a, b, tuple(vrp), tuple(cop), self.near, self.frustum)
+		if key not in self.cache:
+			# 1. Find the view reference coordinate system = [~u,~v, ~n] for α and β using the 3D view algorithm in
+			#    section 4.4
+			u, v, n = Arbit3D(a, b).view()
+			# 2. Align the 3D environment to the standard view for the VRP, CoP, and [~u,~v, ~n] using the 3D
+			#    view-alignment algorithm in section 4.5.
+			# 3. Project the vertex points to the view plane at z = −dn using the projection algorithm in section 4.2.
+			self.projected(key, -cop[2], (vrp, cop, u, v, n))
 
-		# 4. Use the display algorithm from section 4.3 to display the projected	vertex points as 2D lines.
-		pass
+		# 4. Use the display algorithm from section 4.3 to display the projected vertex points as 2D lines.
+		return self.show(self.cache[key], translate, scale)
 
 # Arbitrary 3D View
 class Arbit3D:
@@ -199,6 +469,7 @@ class ArbitAlign:
 		and view reference coordinate system = [~u,~v, ~n], is as follows:
 
 		"""
+		if stats.enabled: start = stats.clock()
 		new_list = []
 
 		# 1. For each vertex point
@@ -217,13 +488,81 @@ class ArbitAlign:
 			
 
 			# (g) Translate the new z-values from step (f) by −dn	using Equation 4.36
-			vertex = vertex[0], vertex[1], vertex[2] + cop[2]
+			vertex = vertex[0], vertex[1], vertex[2] - cop[2]
 
 			new_list.append(vertex)
+		if stats.enabled: stats.record("alignment", start, len(new_list))
 		return new_list
 
+# Vertex Arrays
+def align_vertices(vertices, vrp, cop, u, v, n):
+	"""
+	The 3D view-alignment algorithm of ArbitAlign.align, for an Nx3 array of vertex
+	points at once. Returns the aligned Nx3 array.
+
+	"""
+	if stats.enabled: start = stats.clock()
+	# Translate the x, y, and z-values by -xvrp, -yvrp, and -zvrp using Equations 4.28 to 4.30
+	moved = vertices - numpy.asarray(vrp, dtype=numpy.float64)
+	x, y, z = moved[:,0], moved[:,1], moved[:,2]
+	# Rotate by ~u, ~v, and ~n using Equations 4.31 to 4.33, then translate the z-values by −dn
+	aligned = numpy.empty_like(moved)
+	aligned[:,0] = x * u[0] + y * u[1] + z * u[2]
+	aligned[:,1] = x * v[0] + y * v[1] + z * v[2]
+	aligned[:,2] = x * n[0] + y * n[1] + z * n[2] - cop[2]
+	if stats.enabled: stats.record("alignment", start, len(aligned))
+	return aligned
+
+def project_vertices(vertices, d):
+	"""
+	Projects an Nx3 array of vertex points onto the view plane at z = d, using
+	Equations 4.1 and 4.2 like Point3D.get_2D_point. Returns an Nx2 array.
+
+	"""
+	if stats.enabled: start = stats.clock()
+	if numpy.any(vertices[:,2] == 0):
+		raise ZeroDivisionError("float division by zero")
+	points = vertices[:,:2] / vertices[:,2:3] * d
+	if stats.enabled: stats.record("projection", start, len(points))
+	return points
+
+def cull_endpoints(endpoints, frustum):
+	"""
+	Drops the projected Nx4 (x1, y1, x2, y2) line endpoints that are entirely outside of
+	one side of a (min_x, min_y, max_x, max_y) frustum window on the view plane.
+
+	"""
+	if frustum is None or len(endpoints) == 0: return endpoints
+	min_x, min_y, max_x, max_y = frustum
+	xs = endpoints[:,0::2]
+	ys = endpoints[:,1::2]
+	outside = (xs < min_x).all(axis=1) | (xs > max_x).all(axis=1) | (ys < min_y).all(axis=1) | (ys > max_y).all(axis=1)
+	return endpoints[~outside]
+
+def display_endpoints(endpoints, translate, scale):
+	"""
+	The display algorithm of World3D.display, for an Nx4 array of projected 2D line
+	endpoints (x1, y1, x2, y2) at once. Returns the displayed Nx4 array.
+
+	"""
+	if len(endpoints) == 0: return endpoints
+	if stats.enabled: start = stats.clock()
+	xs = endpoints[:,0::2]
+	ys = endpoints[:,1::2]
+	# 1. Find the center of the 2D points using Equations 4.3 and 4.4.
+	xc = (xs.max() + xs.min()) / 2
+	yc = (ys.max() + ys.min()) / 2
+	# 2. Translate the start and end points by xt and yt from Equations 4.5 and 4.6
+	# 3. Scale the translated points by Sx = sf and Sy = sf for a fix point of (xL, yL)
+	displayed = numpy.empty(endpoints.shape, dtype=numpy.int64)
+	displayed[:,0::2] = numpy.rint(((xs + (translate[0] - xc)) - translate[0]) * scale)
+	displayed[:,1::2] = numpy.rint(((ys + (translate[1] - yc)) - translate[1]) * scale)
+	displayed = displayed + numpy.tile(numpy.asarray(translate), 2)
+	if stats.enabled: stats.record("display", start, len(displayed))
+	return displayed
+
 class DView:
-	def __init__(self, a, b, vrp, cop, point_list, trans, scale):
+	def __init__(self, a, b, vrp, cop, point_list, trans, scale, near=None, frustum=None):
 		self.a = a
 		self.b = b
 		self.vrp = vrp
@@ -231,13 +570,70 @@ class DView:
 		self.point_list = point_list
 		self.trans = trans
 		self.scale = scale
+		# View volume: the near plane distance, and an optional (min_x, min_y, max_x, max_y) window on the view plane
+		self.near = near
+		self.frustum = frustum
+
+	def view(self):
+		"""Returns the view reference coordinate system [~u,~v, ~n] for α and β."""
+		return Arbit3D(self.a, self.b).view()
+
+	def endpoints(self):
+		"""
+		Runs the whole view pipeline on arrays. The view reference coordinate system is
+		found once, and every vertex point is aligned, projected, and displayed together.
+		Returns an Nx4 array of displayed (x1, y1, x2, y2) line endpoints.
+
+		"""
+		# 1. Find the view reference coordinate system = [~u,~v, ~n] for α and β
+		u, v, n = self.view()
+		mesh = self.mesh()
+		# 2. Align the 3D environment to the standard view for the VRP, CoP, and [~u,~v, ~n]
+		mesh = mesh.align(self.vrp, self.cop, u, v, n)
+		# 3. Project the vertex points to the view plane at z = −dn, clipped to the view volume
+		if culled(mesh.hull(), -self.cop[2], self.near, self.frustum): return numpy.zeros((0, 4), dtype=numpy.int64)
+		endpoints = cull_endpoints(mesh.endpoints(-self.cop[2], self.near), self.frustum)
+		# 4. Display the projected vertex points as 2D lines
+		return display_endpoints(endpoints, self.trans, self.scale)
+
+	def lines(self):
+		"""
+		Returns the point list as (start, end) 3D lines. A flat list of 3D points is
+		taken two at a time, like the array path does.
+
+		"""
+		points = self.point_list
+		if len(points) == 0 or not isinstance(points[0][0], numbers.Number): return points
+		if len(points) % 2:
+			raise ValueError("A flat point list needs a start and end point for every line.")
+		return [ (points[i], points[i+1]) for i in range(0, len(points), 2) ]
+
+	def mesh(self):
+		"""Returns the environment as a Mesh. A point list of 3D lines is used as is, without merging vertices."""
+		if isinstance(self.point_list, Mesh): return self.point_list
+		vertices = numpy.asarray(self.lines(), dtype=numpy.float64).reshape(-1, 3)
+		return Mesh(vertices, numpy.arange(len(vertices)).reshape(-1, 2))
+
+	def world(self):
+		"""Returns an empty World3D with this view's view volume."""
+		myworld = World3D()
+		myworld.near = self.near
+		myworld.frustum = self.frustum
+		return myworld
+
 	def run(self):
+		if numpy is not None:
+			return [ Line(x1, y1, x2, y2, (255, 0, 0)) for x1, y1, x2, y2 in self.endpoints().tolist() ]
+
 		# 1. Find the view reference coordinate system = [~u,~v, ~n] for α and β using the 3D view algorithm in
 		#    section 4.4
+		u, v, n = self.view()
+		if isinstance(self.point_list, Mesh):
+			myworld = self.world()
+			myworld.add( self.point_list.align(self.vrp, self.cop, u, v, n) )
+			return myworld.display(-self.cop[2], self.trans, self.scale)
 		new_list = []
-		for point in self.point_list:
-			u, v, n = Arbit3D(self.a, self.b).view()
-
+		for point in self.lines():
 			# 2. Align the 3D environment to the standard view for the VRP, CoP, and [~u,~v, ~n] using the 3D
 			#    view-alignment algorithm in section 4.5.
 			arbit = ArbitAlign(point)
@@ -249,10 +645,10 @@ class DView:
 		# 4. Use the display algorithm from section 4.3 to display the projected vertex points as 2D lines.
 		#print(new_list)
 
-		myworld = World3D()
+		myworld = self.world()
 		for i in new_list:
 			myworld.add(Line3D(i[0], i[1]))
-		finish = myworld.display(self.cop[2], self.trans, self.scale)
+		finish = myworld.display(-self.cop[2], self.trans, self.scale)
 		return finish
 
 		
@@ -356,7 +752,8 @@ def unit_test5():
 	# – Output: Displayed Start-Point = (136, 197), Displayed End-Point
 	# = (184, 43)
 
-	DView(45, 90, (20, 20, 75), (0, 0, 20), [(35, 40, 70), (20, 30, 50)], (160,120), 10).run()
+	test = DView(45, 90, (20, 20, 75), (0, 0, 20), [(35, 40, 70), (20, 30, 50)], (160,120), 10).run()
+	assert([ (line.x1, line.y1, line.x2, line.y2) for line in test ] == [(136, 197, 184, 43)])
 
 	# – Input: Wire-frame environment with one 3D line, Start Point =
 	# (35, 40, 70), End Point = (20, 30, 50). VRP = (0, 0, 20), CoP =
@@ -367,11 +764,45 @@ def unit_test5():
 	# = (150, 123)
 
 	test = DView(0, 0, (0, 0, 20), (0, 0, -20), [(35, 40, 70), (20, 30, 50)], (160,120), 10).run()
-	#print(test[0])
+	assert([ (line.x1, line.y1, line.x2, line.y2) for line in test ] == [(170, 117, 150, 123)])
+	# Both points are in front of the center of projection, so a near plane keeps the line
+	test = DView(0, 0, (0, 0, 20), (0, 0, -20), [(35, 40, 70), (20, 30, 50)], (160,120), 10, near=NEAR).run()
+	assert([ (line.x1, line.y1, line.x2, line.y2) for line in test ] == [(170, 117, 150, 123)])
+
+def unit_test6():
+	"""Testing the vertex array pipeline against the per-point pipeline, with and without a view volume"""
+	global numpy
+	if numpy is None: return
+	rand = random.Random(6)
+	for i in range(300):
+		lines = [ tuple( (rand.uniform(-60, 60), rand.uniform(-60, 60), rand.uniform(-40, 90)) for j in range(2) ) for k in range(rand.randint(1, 12)) ]
+		near = rand.choice([None, NEAR, 5])
+		frustum = rand.choice([None, (-3, -3, 3, 3), (-20, -1, 4, 30)])
+		a, b, cop = rand.uniform(-90, 90), rand.uniform(-90, 90), (0, 0, rand.choice([20, -20, -25]))
+		def lines_view(): return DView(a, b, (0, 0, 0), cop, lines, (160,120), 10, near, frustum).run()
+		def mesh_view(): return DView(a, b, (0, 0, 0), cop, Mesh.from_lines(lines), (160,120), 10, near, frustum).run()
+		def flat_view(): return DView(a, b, (0, 0, 0), cop, [ point for line in lines for point in line ], (160,120), 10, near, frustum).run()
+		def world_view():
+			world = World3D()
+			world.near = near
+			world.frustum = frustum
+			for start, end in lines[:3]: world.add(Line3D(start, end))
+			if len(lines) > 3: world.add(Mesh.from_lines(lines[3:]))
+			return world.finish(a, b, (0, 0, 0), cop, (160,120), 10)
+		for view in [lines_view, mesh_view, flat_view, world_view]:
+			found = []
+			saved = numpy
+			try:
+				for numpy in [saved, None]:
+					try: found.append( [ (line.x1, line.y1, line.x2, line.y2) for line in view() ] )
+					except ZeroDivisionError: found.append(ZeroDivisionError)
+			finally:
+				numpy = saved
+			assert(found[0] == found[1])
 
 def ex1():
 	points = [(35, 40, 70), (20, 30, 50)]
-	outlines = DView(45, 90, (20, 20, 75), (0, 0, -20), points, (160,120), 80).run()
+	outlines = DView(45, 90, (20, 20, 75), (0, 0, 20), points, (160,120), 80).run()
 	#print(outlines[0])
 
 	# Create a Blank Image
@@ -401,10 +832,10 @@ def ex2():
 	many_points.extend([ ((16, 10, 54), (16, 10, 30)), ((8, 16, 30), (0, 10, 30)), ((0, 10, 30), (0, 10, 54)) ])
 	many_points.extend([ ((0, 0, 54), (0, 0, 30)), ((0, 0, 30), (0, 10, 30)), ((0, 0, 30), (16, 0, 30)) ])
 
-	lines = DView(0, 0, (36, 25, 74), (0, 0, -25), many_points, (160,120), 10).run()
-	lines2 = DView(45, -45, (36, 25, 74), (0, 0, -25), many_points, (160,120), 10).run()
+	lines = DView(0, 0, (36, 25, 74), (0, 0, 25), many_points, (160,120), 10).run()
+	lines2 = DView(45, -45, (36, 25, 74), (0, 0, 25), many_points, (160,120), 10).run()
 
-	lines3 = DView(90, 0, (36, 25, 74), (0, 0, -25), many_points, (160,120), 10).run()
+	lines3 = DView(90, 0, (36, 25, 74), (0, 0, 25), many_points, (160,120), 10).run()
 	lines4 = DView(-45, 0, (8, 8, 54), (0, 0, -25), many_points, (160,120), 10).run()
 	#print(lines)
 	for line in lines4:
@@ -422,6 +853,7 @@ if __name__ == "__main__":
 	#unit_test3()
 	#unit_test4()
 	#unit_test5()
+	#unit_test6()
 
 	ex1()
 	#ex2()
\ No newline at end of file
@@ -5,15 +5,165 @@
 # Author Website: http://super3.org/
 # License: GPLv3 <http://gplv3.fsf.org/>
 
+# Imports
+import collections
+import concurrent.futures
+import copy
+import math
+import operator
+import os
+import random
+import shutil
+import tempfile
+import threading
+import weakref
+from Stats import stats
+
+# Optional Imports
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
 # Pixel Class
-class Color:
-	"""Contains RGB color info for pixels. Might use a 3 item tuple instead."""
-	def __init__(self, r, g, b):
-		self.r = r
-		self.g = g
-		self.b = b
+class Color(object):
+	"""
+	Contains RGB color info for pixels. Colors are interned, so there is only one object
+	for each (r, g, b) in use, and it is hashable and compares by identity. The table
+	only holds weak references, so colors nothing uses anymore (like the pixels of a
+	loaded image that is gone) are freed. Its P3 and P6 bytes are found once, when it
+	is made. Treat colors as read-only.
+
+	"""
+	__slots__ = ("r", "g", "b", "p3", "p6", "__weakref__")
+	interned = weakref.WeakValueDictionary()
+	def __new__(cls, r, g, b):
+		color = cls.interned.get( (r, g, b) )
+		if color is None:
+			color = object.__new__(cls)
+			color.r = r
+			color.g = g
+			color.b = b
+			color.p3 = str(color).encode()
+			try:
+				color.p6 = bytes( (r, g, b) )
+			except (TypeError, ValueError):
+				# Binary PPM only holds one whole byte per value
+				color.p6 = None
+			cls.interned[ (r, g, b) ] = color
+		return color
+	def __reduce__(self):
+		# Unpickled colors (in worker processes) are interned too
+		return (Color, (self.r, self.g, self.b))
 	def __str__(self):
 		return "%s %s %s " % (str(self.r), str(self.g), str(self.b))
+	def __repr__(self):
+		return "Color(%r, %r, %r)" % (self.r, self.g, self.b)
+
+def to_color(color):
+	"""Returns the Color for a Color or a 3 item tuple."""
+	if isinstance(color, Color): return color
+	return Color(*color)
+
+def rgb(color):
+	"""Returns an (r, g, b) tuple for a Color or a 3 item tuple."""
+	if isinstance(color, Color):
+		return (color.r, color.g, color.b)
+	return tuple(color)
+
+# Spans
+def points_to_spans(points):
+	"""Packs a list of (x,y) points into a sorted list of (y, x_start, x_end) runs."""
+	spans = []
+	for x, y in sorted(set( (point[0], point[1]) for point in points ), key=operator.itemgetter(1, 0)):
+		if len(spans) > 0 and spans[-1][0] == y and spans[-1][2] == x - 1:
+			spans[-1] = (y, spans[-1][1], x)
+		else:
+			spans.append( (y, x, x) )
+	return spans
+
+def clip_spans(spans, window):
+	"""Clamps a list of (y, x_start, x_end) runs to a (min_x, min_y, max_x, max_y) window, dropping the ones outside."""
+	min_x, min_y, max_x, max_y = window
+	solution = []
+	for y, x_start, x_end in spans:
+		if y < min_y or y > max_y: continue
+		x_start = max(x_start, min_x)
+		x_end = min(x_end, max_x)
+		if x_start <= x_end: solution.append( (y, x_start, x_end) )
+	return solution
+
+def clip_points(points, window):
+	"""Drops the (x,y) points outside of a (min_x, min_y, max_x, max_y) window."""
+	min_x, min_y, max_x, max_y = window
+	return [ point for point in points if min_x <= point[0] <= max_x and min_y <= point[1] <= max_y ]
+
+def overlaps(box, window):
+	"""Checks if two (min_x, min_y, max_x, max_y) boxes share any point."""
+	return box[0] <= window[2] and box[2] >= window[0] and box[1] <= window[3] and box[3] >= window[1]
+
+def intersection(box, window):
+	"""Returns the (min_x, min_y, max_x, max_y) box shared by two boxes. It is empty (min > max) if they don't overlap."""
+	return (max(box[0], window[0]), max(box[1], window[1]), min(box[2], window[2]), min(box[3], window[3]))
+
+def union(box, window):
+	"""Returns the (min_x, min_y, max_x, max_y) box around two boxes."""
+	return (min(box[0], window[0]), min(box[1], window[1]), max(box[2], window[2]), max(box[3], window[3]))
+
+def count_spans(spans):
+	"""Returns the number of points in a list of (y, x_start, x_end) runs."""
+	return sum( x_end - x_start + 1 for y, x_start, x_end in spans )
+
+def spans_to_points(spans):
+	"""Expands a list of (y, x_start, x_end) runs back into (x,y) points."""
+	points = []
+	for y, x_start, x_end in spans:
+		points.extend( (x, y) for x in range(x_start, x_end+1) )
+	return points
+
+# Transform Class
+class Transform:
+	"""
+	A 3x3 affine transformation matrix. Transforms compose without touching any
+	points, and are only applied (and rounded) when the points are needed.
+
+	"""
+	def __init__(self, matrix=None):
+		if matrix is None: matrix = ((1,0,0), (0,1,0), (0,0,1))
+		self.matrix = tuple( tuple(row) for row in matrix )
+	def __mul__(self, other):
+		"""Composes two transforms. (a * b) applies b first, then a."""
+		a = self.matrix
+		b = other.matrix
+		return Transform([ [ sum(a[i][k]*b[k][j] for k in range(3)) for j in range(3) ] for i in range(3) ])
+	def __str__(self):
+		return str(self.matrix)
+
+	# Transformations, each returns a new Transform applied after this one
+	def translate(self, x, y):
+		return Transform( ((1,0,x), (0,1,y), (0,0,1)) ) * self
+	def rotate(self, x, y, angle):
+		"""Rotates by angle degrees about (x,y), like Equations 3.7 and 3.8."""
+		c = math.cos(math.radians(angle))
+		s = math.sin(math.radians(angle))
+		return self.translate(-x,-y).then( ((c,-s,0), (s,c,0), (0,0,1)) ).translate(x,y)
+	def scale(self, x, y, factor_x, factor_y):
+		"""Scales by factor_x and factor_y for a fixed point (x,y), like Equations 3.9 and 3.10."""
+		return self.translate(-x,-y).then( ((factor_x,0,0), (0,factor_y,0), (0,0,1)) ).translate(x,y)
+	def then(self, matrix):
+		return Transform(matrix) * self
+
+	# Application
+	def is_identity(self):
+		return self.matrix == ((1,0,0), (0,1,0), (0,0,1))
+	def apply(self, points):
+		"""Transforms a list of (x,y) points in one step, and rounds them once."""
+		(a, b, c), (d, e, f), _ = self.matrix
+		if numpy is not None and len(points) > 0:
+			array = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+			out = numpy.rint(array @ numpy.array( ((a, d), (b, e)) ) + (c, f)).astype(numpy.int64)
+			return [ tuple(point) for point in out.tolist() ]
+		return [ (round(a*x + b*y + c), round(d*x + e*y + f)) for x, y in points ]
 
 # Shape Class
 class Shape(object):
@@ -23,8 +173,11 @@ class Shape(object):
 		self.border_color = color
 		self.inside_color = color
 		self.border = []
-		self.inside = []
+		self.spans = []
 		self.do_fill = False
+		self.matrix = None
+		# The raster_key of the stored points, if they are unclipped
+		self.raster = None
 	def __str__(self):
 		"""Returns a string containing all the points in the shape."""
 		output = ""
@@ -32,17 +185,96 @@ class Shape(object):
 			output += str(a_point) + ", "
 		return output
 
+	# Inside Points
+	@property
+	def inside(self):
+		"""The inside points (or fill), expanded from the shape's spans."""
+		return spans_to_points(self.spans)
+	@inside.setter
+	def inside(self, points):
+		self.spans = points_to_spans(points)
+
 	# Drawing Functions
-	def draw(self):
-		"""Calculates a shape's points, and stores it."""
-		self.border = self.draw_border()
-		if self.do_fill: self.inside = self.draw_inside()
-	def draw_border(self):
-		"""Calculates a shape's border points."""
+	def draw(self, window=None):
+		"""
+		Calculates a shape's points, and stores it. Any pending transform is used, but not
+		applied. If a (min_x, min_y, max_x, max_y) window is passed, only the points inside
+		of it are calculated.
+
+		"""
+		if stats.enabled: start = stats.clock()
+		shape = self.transformed()
+		box = shape.bounds()
+		if window is not None and not overlaps(box, window):
+			# Entirely outside of the window, so there is nothing to calculate
+			self.border = []
+			if self.do_fill: self.spans = []
+			self.raster = None
+		elif window is None or intersection(box, window) == box:
+			# Nothing is clipped, so the points can be reused
+			raster = shape.raster_key() if raster_cache.max_bytes > 0 else None
+			if raster is None or raster != self.raster:
+				self.border, spans = shape.rasterize(raster)
+				if self.do_fill: self.spans = spans
+				self.raster = raster
+		else:
+			self.border = shape.draw_border(window)
+			if self.do_fill: self.spans = shape.draw_spans(window)
+			self.raster = None
+		if stats.enabled:
+			points = len(self.border) + (count_spans(self.spans) if self.do_fill else 0)
+			stats.generated += points
+			stats.record("draw " + type(self).__name__, start, points)
+	def draw_border(self, window=None):
+		"""Calculates a shape's border points, inside of the window if one is passed."""
 		raise NotImplementedError
 	def draw_inside(self):
 		"""Calculates a shapes's inside points (or fill)."""
 		raise NotImplementedError
+	def draw_spans(self, window=None):
+		"""Calculates a shape's inside (or fill) as (y, x_start, x_end) runs, inside of the window if one is passed."""
+		spans = points_to_spans(self.draw_inside())
+		if window is not None: spans = clip_spans(spans, window)
+		return spans
+	def bounds(self):
+		"""Returns the (min_x, min_y, max_x, max_y) box around every point the shape draws. Implemented by child class."""
+		raise NotImplementedError
+
+	# Raster Cache
+	def geometry(self):
+		"""Returns the ([(x,y) points], (sizes)) that the shape's points are calculated from. Implemented by child class."""
+		raise NotImplementedError
+	def raster_key(self):
+		"""
+		Returns (key, origin): a key for the shape's points relative to an (x, y) origin,
+		and that origin. The origin is always even, since ties are rounded to even, so
+		shapes only share points across whole even steps. Returns None if the geometry
+		isn't whole numbers.
+
+		"""
+		points, sizes = self.geometry()
+		if len(points) == 0: return None
+		values = [ value for point in points for value in point[:2] ]
+		values.extend(sizes)
+		if not all( float(value).is_integer() for value in values ): return None
+		x = int(points[0][0]) & ~1
+		y = int(points[0][1]) & ~1
+		relative = tuple( (int(point[0]) - x, int(point[1]) - y) for point in points )
+		return (type(self), self.do_fill, relative, tuple( int(size) for size in sizes )), (x, y)
+	def rasterize(self, raster=None):
+		"""Calculates the shape's (border, spans), unclipped. Points are shared through the raster cache if a raster_key is passed."""
+		if raster is None:
+			return self.draw_border(), self.draw_spans() if self.do_fill else []
+		key, (x, y) = raster
+		entry = raster_cache.get(key)
+		if entry is None:
+			border = self.draw_border()
+			spans = self.draw_spans() if self.do_fill else []
+			raster_cache.put(key, [ (point[0] - x, point[1] - y) for point in border ], [ (row - y, x_start - x, x_end - x) for row, x_start, x_end in spans ])
+			return border, spans
+		# Offset the cached points to the shape's origin
+		border, spans = entry
+		return [ (point[0] + x, point[1] + y) for point in border ], [ (row + y, x_start + x, x_end + x) for row, x_start, x_end in spans ]
 	def fill(self, color = None):
 		"""Fills the shape with a color. If no color is passed, then the border color will be used."""
 		self.do_fill = True
@@ -53,73 +285,616 @@ class Shape(object):
 	# Cleanup Function
 	def remove_duplicates(self, points):
 		"""Removes duplicates from a list by converting it to a set then back to a list."""
-		return list(set(points))
+		if stats.enabled: start = stats.clock()
+		solution = list(set(points))
+		if stats.enabled: stats.record("dedup", start, len(points))
+		return solution
 	
 	# Transformations
 	def move(self, x, y):
-		"""Translate any shape."""
-
-		# Temp Vars
-		tmp_border = []
-		tmp_inside = []
+		"""
+		Translate any shape. Its calculated points are moved along, so it doesn't need to be
+		redrawn, and the translation is kept pending for the next draw.
 
+		"""
 		# Translate
-		for point in self.border:
-			tmp_border.append( (point[0]+x, point[1]+y) )
-		for point in self.inside:
-			tmp_border.append( (point[0]+x, point[1]+y) )	
+		self.border = [ (point[0]+x, point[1]+y) for point in self.border ]
+		self.spans = [ (row+y, x_start+x, x_end+x) for row, x_start, x_end in self.spans ]
+		self.raster = None
+		return self.transform( Transform().translate(x, y) )
 
-		# Save Translated Data
-		self.border = tmp_border
-		self.inside = tmp_inside
-
-	def translate(self, x, y):
+	def transform(self, matrix):
+		"""Lazily transforms a shape. The Transform is composed after any pending one, and applied when drawn."""
+		if self.matrix is None: self.matrix = matrix
+		else: self.matrix = matrix * self.matrix
+		return self
+	def apply(self):
+		"""Applies a shape's pending transform to its points, rounding once."""
+		# Every in-place transformation goes through here, so the stored points are out of date
+		self.raster = None
+		if self.matrix is not None:
+			matrix = self.matrix
+			self.matrix = None
+			if not matrix.is_identity(): self.apply_matrix(matrix)
+		return self
+	def transformed(self):
+		"""Returns the shape with its pending transform applied, as a copy if there is one."""
+		if self.matrix is None: return self
+		return copy.copy(self).apply()
+	def apply_matrix(self, matrix):
+		"""Transforms a shape's points by a Transform. Implemented by child class."""
 		raise NotImplementedError
+	def translate(self, x, y):
+		"""Translates a shape, as a pending Transform."""
+		return self.transform( Transform().translate(x, y) )
 	def rotate(self, x, y, angle):
-		raise NotImplementedError
+		"""Rotates a shape by angle degrees about (x,y), as a pending Transform."""
+		return self.transform( Transform().rotate(x, y, angle) )
 	def scale(self, x, y, factor_x, factor_y):
-		raise NotImplementedError
+		"""Scales a shape for a fixed point (x,y), as a pending Transform."""
+		return self.transform( Transform().scale(x, y, factor_x, factor_y) )
 	def scale_eq(self, x, y, factor):
-		self.scale(x, y, factor, factor)
+		"""Scales a shape by the same factor on both axes, as a pending Transform."""
+		return self.scale(x, y, factor, factor)
+
+# Raster Cache
+class RasterCache:
+	"""
+	A process-wide LRU of calculated shape points, keyed on a shape's geometry relative
+	to its origin, so identical primitives (like repeated Circle markers) are calculated
+	only once. Stored points are counted against max_bytes, at roughly point_bytes each.
+	Set max_bytes to 0 to turn it off.
+
+	"""
+	point_bytes = 64
+	def __init__(self, max_bytes=32 * 1024 * 1024):
+		self.max_bytes = max_bytes
+		self.entries = collections.OrderedDict()
+		self.size = 0
+	def __len__(self):
+		return len(self.entries)
+	def get(self, key):
+		"""Returns the (border, spans) stored for a key, or None."""
+		entry = self.entries.get(key)
+		if entry is None: return None
+		self.entries.move_to_end(key)
+		return entry[0], entry[1]
+	def put(self, key, border, spans):
+		"""Stores the (border, spans) for a key, forgetting the least recently used points to stay under max_bytes."""
+		size = (len(border) + len(spans)) * self.point_bytes
+		if size > self.max_bytes: return
+		if key in self.entries: self.size -= self.entries.pop(key)[2]
+		self.entries[key] = (tuple(border), tuple(spans), size)
+		self.size += size
+		while self.size > self.max_bytes:
+			self.size -= self.entries.popitem(last=False)[1][2]
+	def clear(self):
+		self.entries.clear()
+		self.size = 0
+
+raster_cache = RasterCache()
+
+# PPM Header
+def read_header(f):
+	"""
+	Reads a PPM header from an open binary file. Returns the magic number, the
+	x size, the y size, the intensity, and the byte offset of the pixel data.
+
+	"""
+	fields = []
+	offset = 0
+	data = f.read(1024)
+	while len(fields) < 4:
+		# Skip whitespace and comments
+		while offset < len(data) and (data[offset:offset+1].isspace() or data[offset:offset+1] == b"#"):
+			if data[offset:offset+1] == b"#":
+				end = data.find(b"\n", offset)
+				if end == -1:
+					more = f.read(1024)
+					if not more: raise ValueError("Truncated PPM header.")
+					data += more
+					continue
+				offset = end
+			offset += 1
+		# Read one field
+		end = offset
+		while end < len(data) and not data[end:end+1].isspace() and data[end:end+1] != b"#":
+			end += 1
+		if end == len(data):
+			more = f.read(1024)
+			if not more: raise ValueError("Truncated PPM header.")
+			data += more
+			continue
+		fields.append(data[offset:end])
+		offset = end
+	if fields[0] not in (b"P3", b"P6"):
+		raise ValueError("Not a P3 or P6 PPM file.")
+	# A single whitespace character separates the header from the pixel data
+	return fields[0], int(fields[1]), int(fields[2]), int(fields[3]), offset + 1
+
+def write_header(size_x, size_y, inten, binary = False):
+	"""Returns the PPM header bytes for an image: P6 if binary, else P3."""
+	if binary and inten > 255:
+		raise ValueError("Binary PPM output only supports an intensity of 255 or less.")
+	head = "P6\n" if binary else "P3\n"
+	head += "# Created by Shawn Wilkinson\n"
+	head += str(size_x) + " " + str(size_y) + "\n"
+	head += str(inten) + "\n"
+	return head.encode()
 
 # Image Class
 class Image:
 	"""Contains all pixel data for in image."""
-	def __init__(self, size_x, size_y, inten = 255):
-		"""Initialize vars, and fill image with white."""
+	def __init__(self, size_x, size_y, inten = 255, array = False, img = None, palette = False):
+		"""
+		Initialize vars, and fill image with white unless pixel data is passed. Pass
+		array=True for a numpy framebuffer, or palette=True for one byte per pixel.
+
+		"""
+		if array and numpy is None:
+			raise ImportError("Array-backed images require numpy.")
 		self.x = size_x
 		self.y = size_y
 		self.inten = inten
-		self.img = []
-		self.fill()
+		self.array = array and not palette
+		self.img = img
+		# Palette images store an index into palette for every pixel, in a bytearray
+		self.palette = [] if palette else None
+		self.colors = {}
+		# The P6 file a mapped image's pixels live in
+		self.path = None
+		if img is None: self.fill()
+	@classmethod
+	def load(cls, path, array = None):
+		"""
+		Loads a P3 or P6 PPM file. Binary (P6) files are memory-mapped copy-on-write
+		when array-backed, so drawing on the loaded image never touches the file.
+		If array is None, numpy is used whenever it is available and the intensity fits
+		in a byte.
+
+		"""
+		f = open(path, 'rb')
+		magic, size_x, size_y, inten, offset = read_header(f)
+		if array is None: array = numpy is not None and inten <= 255
+		if array and inten > 255:
+			raise ValueError("Array-backed images only support an intensity of 255 or less.")
+		if magic == b"P6" and inten > 255:
+			raise ValueError("Binary PPM input only supports an intensity of 255 or less.")
+		shape = (size_y, size_x, 3)
+		if magic == b"P6":
+			if array:
+				f.close()
+				return cls(size_x, size_y, inten, True, numpy.memmap(path, numpy.uint8, 'c', offset, shape))
+			f.seek(offset)
+			values = f.read(size_x * size_y * 3)
+		else:
+			f.seek(offset)
+			values = [ int(v) for v in f.read().split() ]
+		f.close()
+		if len(values) < size_x * size_y * 3:
+			raise ValueError("PPM file %s is missing pixel data." % path)
+		if array:
+			return cls(size_x, size_y, inten, True, numpy.array(values[:size_x * size_y * 3], numpy.uint8).reshape(shape))
+		# Share one Color object per distinct pixel value, like fill and blit do
+		colors = {}
+		img = []
+		for i in range(0, size_x * size_y * 3, 3):
+			key = (values[i], values[i+1], values[i+2])
+			if key not in colors: colors[key] = Color(*key)
+			img.append(colors[key])
+		return cls(size_x, size_y, inten, False, img)
+	@classmethod
+	def mapped(cls, path, size_x, size_y, background = Color(255,255,255)):
+		"""
+		Creates an array-backed image whose pixels are a writable memory map of a new
+		binary (P6) PPM file. The header is written up front, and blits go straight into
+		the file's pixel data, so saving it to the same path only has to flush. The OS
+		pages pixels in and out as they are drawn, so the image needn't fit in memory.
+
+		"""
+		if numpy is None:
+			raise ImportError("Mapped images require numpy.")
+		head = write_header(size_x, size_y, 255, True)
+		f = open(path, 'wb')
+		f.write(head)
+		f.truncate(len(head) + size_x * size_y * 3)
+		f.close()
+		img = cls(size_x, size_y, 255, True, numpy.memmap(path, numpy.uint8, 'r+', len(head), (size_y, size_x, 3)))
+		img.path = path
+		# A new file is already all zeros (and sparse), so black needs no filling
+		if rgb(background) != (0, 0, 0): img.fill(background)
+		return img
 	def fill(self, color=Color(255,255,255)):
 		"""Fill the image with a passed background color. Default white."""
-		for y in range(self.y):
-			for x in range(self.x):
-				self.img.append( color )
+		if stats.enabled: start = stats.clock()
+		if self.palette is not None:
+			# Every pixel is the first (and only) color
+			color = to_color(color)
+			self.palette = [color]
+			self.colors = {color: 0}
+			self.img = bytearray(self.x * self.y)
+		elif self.array:
+			# Contiguous HxWx3 buffer, allocated once and overwritten on refill
+			if self.img is None:
+				self.img = numpy.empty((self.y, self.x, 3), dtype=numpy.uint8)
+			self.img[:] = rgb(color)
+		else:
+			self.img = [to_color(color)] * (self.x * self.y)
+		if stats.enabled: stats.record("fill", start, self.x * self.y)
 	def getIndex(self, x, y):
 		"""Get pixel index from (x,y)."""
 		# I = x + xd(yd − y − 1) + 1
 		return x + self.x * ( self.y - y - 1 ) - 1
-	def blit(self, shapeObj):
-		"""Draw a shape onto the image."""
+	def getIndices(self, points):
+		"""Get an array of pixel indices from a list of (x,y) points."""
+		points = numpy.asarray(points).reshape(-1, 2).astype(numpy.intp)
+		return points[:,0] + self.x * ( self.y - points[:,1] - 1 ) - 1
+	def pixels(self):
+		"""Flat (x*y)x3 view of an array-backed image, in getIndex order."""
+		return self.img.reshape(-1, 3)
+	def color_index(self, color):
+		"""
+		Returns a color's index in a palette image's palette, adding it if needed. Once
+		more than 256 colors are used, the image switches to full color (array-backed
+		with numpy, else a list), and None is returned.
+
+		"""
+		color = to_color(color)
+		index = self.colors.get(color)
+		if index is not None: return index
+		if len(self.palette) < 256:
+			self.colors[color] = len(self.palette)
+			self.palette.append(color)
+			return self.colors[color]
+		# The palette is full
+		if numpy is not None:
+			table = numpy.array([ rgb(c) for c in self.palette ], dtype=numpy.uint8)
+			self.img = table[ numpy.frombuffer(self.img, dtype=numpy.uint8) ].reshape(self.y, self.x, 3)
+			self.array = True
+		else:
+			self.img = [ self.palette[i] for i in self.img ]
+		self.palette = None
+		self.colors = {}
+		return None
+	def viewport(self):
+		"""
+		Returns the (min_x, min_y, max_x, max_y) window of points that getIndex maps onto
+		the image. Points outside of it would wrap into the wrong row, so they are clipped.
+
+		"""
+		return (1, 0, self.x, self.y - 1)
+	def blit(self, shapeObj, window = None):
+		"""
+		Draw a shape onto the image. Only the points inside of the viewport, and of the
+		(min_x, min_y, max_x, max_y) window if one is passed, are calculated.
+
+		"""
 		# Calculate Object's Points
-		shapeObj.draw()
+		if window is None: shapeObj.draw(self.viewport())
+		else: shapeObj.draw(intersection(self.viewport(), window))
 		# Draw Object on Image
-		for point in shapeObj.inside:
-			self.img[ self.getIndex(point[0], point[1]) ] = shapeObj.inside_color
-		for point in shapeObj.border:
-			self.img[ self.getIndex(point[0], point[1]) ] = shapeObj.border_color
-	def save(self, path):
-		"""Saves a PPM file to the specified path."""
+		self.blit_spans(shapeObj.spans, shapeObj.inside_color)
+		self.blit_points(shapeObj.border, shapeObj.border_color)
+	def encode(self, binary = False):
+		"""Returns the pixel data of the image as PPM bytes (P6 if binary, else P3)."""
+		if self.palette is not None:
+			if binary:
+				for c in self.palette:
+					if c.p6 is None: raise ValueError("Color %r doesn't fit in a binary PPM." % (c,))
+			if binary and numpy is not None:
+				table = numpy.array([ rgb(c) for c in self.palette ], dtype=numpy.uint8)
+				return table[ numpy.frombuffer(self.img, dtype=numpy.uint8) ].tobytes()
+			# Each palette color is already encoded
+			table = [ c.p6 if binary else c.p3 for c in self.palette ]
+			return b"".join([ table[i] for i in self.img ])
+		if self.array:
+			if binary: return self.img.tobytes()
+			# Same "r g b " layout as Color.__str__: look up the characters of every value
+			# from 0 to inten in a table padded to the widest, then drop the padding
+			values = [ b"%d " % value for value in range(self.inten + 1) ]
+			width = max( len(value) for value in values )
+			table = numpy.zeros( (len(values), width), dtype=numpy.uint8 )
+			for value, text in enumerate(values): table[value, :len(text)] = list(text)
+			lengths = numpy.array([ len(text) for text in values ])
+			flat = self.img.ravel()
+			return table[flat][ numpy.arange(width) < lengths[flat][:,None] ].tobytes()
+		# Pixels share a handful of color objects, each already encoded
+		cache = {}
+		for pix in self.img:
+			if pix not in cache:
+				cache[pix] = to_color(pix).p6 if binary else to_color(pix).p3
+				if cache[pix] is None: raise ValueError("Color %r doesn't fit in a binary PPM." % (pix,))
+		return b"".join([ cache[pix] for pix in self.img ])
+	def blit_spans(self, spans, color):
+		"""Draw a list of (y, x_start, x_end) runs onto the image in one color, a row slice at a time."""
+		if stats.enabled: began = stats.clock()
+		index = self.color_index(color) if self.palette is not None and len(spans) > 0 else None
+		if index is not None: img, value = self.img, bytes( (index,) )
+		elif self.array: img, value = self.pixels(), rgb(color)
+		else: img, value = self.img, [to_color(color)]
+		written = 0
+		for y, x_start, x_end in clip_spans(spans, self.viewport()):
+			start = self.getIndex(x_start, y)
+			end = self.getIndex(x_end, y) + 1
+			if self.array and index is None: img[start:end] = value
+			else: img[start:end] = value * (end - start)
+			written += end - start
+		if stats.enabled:
+			stats.written += written
+			stats.record("blit", began, written)
+	def blit_points(self, points, color):
+		"""Draw a list (or Nx2 array) of (x,y) points onto the image in one color. Points outside of the viewport are dropped."""
+		if stats.enabled: began = stats.clock()
+		min_x, min_y, max_x, max_y = self.viewport()
+		if len(points) == 0: return
+		index = self.color_index(color) if self.palette is not None else None
+		if (self.array or index is not None) and numpy is not None:
+			points = numpy.asarray(points).reshape(-1, 2)
+			inside = (points[:,0] >= min_x) & (points[:,0] <= max_x) & (points[:,1] >= min_y) & (points[:,1] <= max_y)
+			points = points[inside]
+			if index is not None: numpy.frombuffer(self.img, dtype=numpy.uint8)[ self.getIndices(points) ] = index
+			else: self.pixels()[ self.getIndices(points) ] = rgb(color)
+		else:
+			points = clip_points(points, self.viewport())
+			value = index if index is not None else to_color(color)
+			for point in points:
+				self.img[ self.getIndex(point[0], point[1]) ] = value
+		if stats.enabled:
+			stats.written += len(points)
+			stats.record("blit", began, len(points))
+	def snapshot(self):
+		"""Returns a copy of the image's pixels, which later drawing doesn't change."""
+		if self.palette is not None:
+			img = Image(self.x, self.y, self.inten, img = bytearray(self.img), palette = True)
+			img.palette = list(self.palette)
+			img.colors = dict(self.colors)
+			return img
+		if self.array: return Image(self.x, self.y, self.inten, True, numpy.array(self.img))
+		return Image(self.x, self.y, self.inten, False, list(self.img))
+	def flush(self):
+		"""Writes a mapped image's pixels out to its file."""
+		if self.path is not None: self.img.flush()
+	def save(self, path, binary = None):
+		"""
+		Saves a PPM file to the specified path. Binary (P6) if binary, else ASCII (P3).
+		If binary is None, a mapped image saved to its own file is binary, like the file.
+
+		"""
+		if self.path is not None and os.path.abspath(path) == os.path.abspath(self.path):
+			# The file already holds the pixels
+			if binary is False:
+				raise ValueError("A mapped image can only be saved to its own file as binary (P6).")
+			if stats.enabled: start = stats.clock()
+			self.flush()
+			if stats.enabled: stats.record("save", start, 0)
+			return
 		# Header
-		head = "P3\n"
-		head += "# Created by Shawn Wilkinson\n"
-		head += str(self.x) + " " + str(self.y) + "\n"
-		head += str(self.inten) + "\n"
+		head = write_header(self.x, self.y, self.inten, binary)
 		# Write to File
-		f = open(path, 'w+')
-		f.write(head)
-		for pix in self.img:
-			f.write(str(pix))
-		f.close()
\ No newline at end of file
+		if stats.enabled: start = stats.clock()
+		data = head + self.encode(binary)
+		f = open(path, 'wb')
+		f.write(data)
+		f.close()
+		if stats.enabled: stats.record("save", start, len(data))
+	def save_async(self, path, binary = None):
+		"""
+		Saves a PPM file on the shared background writer, and returns a Future for it. The
+		pixels are copied first, so drawing the next frame can start right away. Blocks
+		while the writer already has its max_pending saves queued.
+
+		"""
+		return writer.save(self, path, binary)
+
+# Background Saving
+def write_image(img, path, binary):
+	"""Saves an image, and returns the path. Run by Writer workers."""
+	img.save(path, binary)
+	return path
+
+class Writer:
+	"""
+	Saves images on background threads (or worker processes, if processes is True).
+	Each save is handed a snapshot of the image's pixels, and returns a Future. At most
+	max_pending saves (and so snapshots) are queued or running at once; save() blocks
+	until there is room. Threads overlap the file writes, and binary encoding, with
+	drawing. ASCII (P3) encoding holds the interpreter, so it only overlaps in processes.
+
+	"""
+	def __init__(self, workers=1, max_pending=2, processes=False):
+		if processes: self.pool = concurrent.futures.ProcessPoolExecutor(workers)
+		else: self.pool = concurrent.futures.ThreadPoolExecutor(workers)
+		self.slots = threading.BoundedSemaphore(max_pending)
+	def __enter__(self):
+		return self
+	def __exit__(self, *exc):
+		self.close()
+	def save(self, img, path, binary = None):
+		"""Saves an image like img.save(path, binary), in the background. Returns a Future."""
+		if img.path is not None and os.path.abspath(path) == os.path.abspath(img.path):
+			# A mapped image's file is the image, so there is nothing to copy or encode
+			future = concurrent.futures.Future()
+			img.save(path, binary)
+			future.set_result(path)
+			return future
+		self.slots.acquire()
+		try:
+			future = self.pool.submit(write_image, img.snapshot(), path, binary)
+		except:
+			self.slots.release()
+			raise
+		future.add_done_callback(lambda done: self.slots.release())
+		return future
+	def close(self, wait=True):
+		"""Stops the writer, after finishing every queued save if wait is True."""
+		self.pool.shutdown(wait)
+
+writer = Writer()
+
+# Unit Tests
+def unit_test1():
+	"""Testing that list, array, and palette images encode the same PPM bytes"""
+	global numpy
+	rand = random.Random(1)
+	saved = numpy
+	try:
+		for numpy in [saved, None]:
+			# The palette fills up past 256 colors, and switches to full color
+			for count in [40, 300]:
+				images = [ Image(40, 30), Image(40, 30, palette = True) ]
+				if numpy is not None: images.append( Image(40, 30, array = True) )
+				for i in range(count):
+					color = (rand.randrange(256), rand.randrange(256), rand.randrange(256))
+					x = rand.randrange(1, 41)
+					span = (rand.randrange(0, 29), x, rand.randrange(x, 41))
+					for img in images: img.blit_spans([span], color)
+				assert((images[1].palette is None) == (count > 256))
+				for binary in [False, True]:
+					encoded = [ img.encode(binary) for img in images ]
+					assert(all( data == encoded[0] for data in encoded ))
+			# Colors over 255 don't fit in a binary PPM, whatever the backend
+			for img in [ Image(4, 4, 300), Image(4, 4, 300, palette = True) ]:
+				img.blit_spans([(1, 1, 2)], (300, 0, 0))
+				assert(b"300 0 0 " in img.encode(False))
+				try:
+					img.encode(True)
+					assert(False)
+				except ValueError:
+					pass
+	finally:
+		numpy = saved
+
+def unit_test2():
+	"""Testing loading P3 and P6 files with header comments, mapped copy-on-write, and with intensities over 255"""
+	global numpy
+	folder = tempfile.mkdtemp()
+	saved = numpy
+	try:
+		rand = random.Random(2)
+		values = [ rand.randrange(256) for i in range(5 * 4 * 3) ]
+		pixels = [ tuple(values[i:i+3]) for i in range(0, len(values), 3) ]
+		path = os.path.join(folder, "comments.ppm")
+		data = b"P6\n# Made by hand\n5 4 # width and height\n#\n255\n" + bytes(values)
+		f = open(path, 'wb')
+		f.write(data)
+		f.close()
+		for numpy in [saved, None]:
+			for array in ([None, True, False] if numpy is not None else [None]):
+				img = Image.load(path, array)
+				assert(img.array == (numpy is not None and array is not False))
+				found = img.pixels().tolist() if img.array else img.img
+				assert([ tuple(rgb(c)) for c in found ] == pixels)
+				# Drawing on a loaded image never touches the file
+				img.blit_spans([ (y, 1, 5) for y in range(4) ], (1, 2, 3))
+				img.blit_points([ (2, 2) ], (4, 5, 6))
+				if img.array:
+					assert(isinstance(img.img, numpy.memmap))
+					img.flush()
+				f = open(path, 'rb')
+				assert(f.read() == data)
+				f.close()
+		# Intensities over 255 only fit in a P3 file, which loads list-backed unless array is passed
+		path = os.path.join(folder, "deep.ppm")
+		values = [ rand.randrange(1001) for i in range(3 * 2 * 3) ]
+		f = open(path, 'wb')
+		f.write( b"P3\n# Deep\n3 2\n1000\n" + " ".join(map(str, values)).encode() + b"\n" )
+		f.close()
+		for numpy in [saved, None]:
+			img = Image.load(path)
+			assert(not img.array and img.inten == 1000)
+			assert(img.encode(False) == (" ".join(map(str, values)) + " ").encode())
+			if numpy is not None:
+				try:
+					Image.load(path, True)
+					assert(False)
+				except ValueError:
+					pass
+	finally:
+		numpy = saved
+		shutil.rmtree(folder)
+
+def unit_test3():
+	"""Testing that saving a mapped image gives the same file as saving the same image in memory"""
+	if numpy is None: return
+	folder = tempfile.mkdtemp()
+	def read(name):
+		f = open(os.path.join(folder, name), 'rb')
+		data = f.read()
+		f.close()
+		return data
+	try:
+		rand = random.Random(3)
+		for background in [(0, 0, 0), (255, 255, 255), (10, 20, 30)]:
+			path = os.path.join(folder, "mapped.ppm")
+			img = Image.mapped(path, 37, 23, background)
+			expected = Image(37, 23, array = True)
+			expected.fill(background)
+			for i in range(30):
+				color = (rand.randrange(256), rand.randrange(256), rand.randrange(256))
+				x = rand.randrange(-5, 42)
+				spans = [ (y, x, x + rand.randrange(20)) for y in range(rand.randrange(-5, 28), 28) ]
+				points = [ (rand.randrange(-5, 42), rand.randrange(-5, 28)) for j in range(10) ]
+				for each in [img, expected]:
+					each.blit_spans(spans, color)
+					each.blit_points(points, color)
+			for binary in [False, True]:
+				img.save(os.path.join(folder, "copy.ppm"), binary)
+				expected.save(os.path.join(folder, "expected.ppm"), binary)
+				assert(read("copy.ppm") == read("expected.ppm"))
+			# Saved to its own file, it is that binary file
+			img.save(path)
+			assert(read("mapped.ppm") == read("expected.ppm"))
+			del img
+	finally:
+		shutil.rmtree(folder)
+
+def unit_test4():
+	"""Testing that background saves finish with the pixels they were given, and that at most max_pending are queued"""
+	folder = tempfile.mkdtemp()
+	def read(path):
+		f = open(path, 'rb')
+		data = f.read()
+		f.close()
+		return data
+	try:
+		img = Image(20, 10)
+		paths = [ os.path.join(folder, "frame%d.ppm" % i) for i in range(4) ]
+		with Writer(workers = 1, max_pending = 2) as saver:
+			# Keep the only worker busy, so every save stays queued
+			busy = threading.Event()
+			saver.pool.submit(busy.wait)
+			try:
+				futures = []
+				expected = []
+				for i in range(2):
+					img.blit_spans([ (i, 1, 20) ], (i, 0, 0))
+					futures.append( saver.save(img, paths[i], i == 1) )
+					expected.append( img.snapshot() )
+				# Both slots are taken, so the next save blocks until one of them is written
+				blocked = threading.Thread(target = lambda: futures.append( saver.save(img, paths[2]) ))
+				blocked.start()
+				blocked.join(.2)
+				assert(blocked.is_alive() and len(futures) == 2)
+				# Drawing after a save doesn't change what it writes
+				img.blit_spans([ (5, 1, 20) ], (9, 9, 9))
+				expected.append( img.snapshot() )
+			finally:
+				busy.set()
+			blocked.join()
+			assert([ future.result() for future in futures ] == paths[:3])
+		for i in range(3):
+			expected[i].save(paths[3], i == 1)
+			assert(read(paths[i]) == read(paths[3]))
+		# The shared writer, through save_async
+		assert(img.save_async(paths[0], True).result() == paths[0])
+		img.save(paths[3], True)
+		assert(read(paths[0]) == read(paths[3]))
+	finally:
+		shutil.rmtree(folder)
+
+# Main
+if __name__ == "__main__":
+	unit_test1()
+	unit_test2()
+	unit_test3()
+	unit_test4()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# Filename: Render.py
+# Project Github: http://github.com/super3/ClassDev
+# Author: Shawn Wilkinson <me@super3.org>
+# Author Website: http://super3.org/
+# License: GPLv3 <http://gplv3.fsf.org/>
+
+# Imports
+import copy
+import multiprocessing
+import os
+import random
+import tempfile
+from multiprocessing import shared_memory
+from GeoPrimitives import *
+
+# Windows
+def index_range(img, box):
+	"""Returns the [start, end) range of pixel indices that a (min_x, min_y, max_x, max_y) box can touch."""
+	min_x, min_y, max_x, max_y = box
+	return img.getIndex(min_x, max_y), img.getIndex(max_x, min_y) + 1
+
+def tile_window(img, start, end):
+	"""Returns the (min_x, min_y, max_x, max_y) window of a tile's [start, end) pixel index range."""
+	min_x, min_y, max_x, max_y = img.viewport()
+	return (min_x, max(min_y, max_y - (end // img.x) + 1), max_x, max_y - (start // img.x))
+
+def blit_window(img, shapeObj, start, end):
+	"""Draw a shape onto an array-backed image, like img.blit, but only inside of the tile from start to end."""
+	img.blit(shapeObj, tile_window(img, start, end))
+
+# Tiles
+def tiles(img, tile_height):
+	"""Splits an image into tiles of tile_height rows. Returns the [start, end) pixel index range of every tile."""
+	# Whole rows of the buffer, from the top of the image down
+	return [ (row * img.x, min(row + tile_height, img.y) * img.x) for row in range(0, img.y, tile_height) ]
+
+def bin_shapes(img, shapes, windows):
+	"""Returns, for every tile, the shapes whose bounding box can touch it, in drawing order."""
+	viewport = img.viewport()
+	tile_size = windows[0][1] - windows[0][0]
+	bins = [ [] for window in windows ]
+	for shape in shapes:
+		box = shape.bounds()
+		# Shapes outside of the image are never drawn
+		if not overlaps(box, viewport): continue
+		box = intersection(box, viewport)
+		low, high = index_range(img, box)
+		for i in range(low // tile_size, (high - 1) // tile_size + 1):
+			bins[i].append(shape)
+	return bins
+
+def render_tile(job):
+	"""Draws a tile's shapes straight into the shared framebuffer."""
+	name, size_x, size_y, start, end, shapes = job
+	memory = shared_memory.SharedMemory(name=name)
+	try:
+		img = Image(size_x, size_y, array = True, img = numpy.ndarray((size_y, size_x, 3), numpy.uint8, memory.buf))
+		for shape in shapes:
+			blit_window(img, shape, start, end)
+		del img
+	finally:
+		memory.close()
+	return end - start
+
+def blit_tiled(img, shapes, tile_height=64, processes=None):
+	"""
+	Draws a list of shapes onto an array-backed image, giving exactly the same pixels as
+	calling img.blit on each in order. The image is split into tiles of tile_height rows,
+	the shapes are binned by bounding box, and worker processes draw their tiles straight
+	into a shared memory copy of the framebuffer.
+
+	"""
+	if not img.array:
+		raise ValueError("Tiled rendering requires an array-backed image.")
+	windows = tiles(img, tile_height)
+	bins = bin_shapes(img, shapes, windows)
+
+	# A single process draws in place, which is easier to debug
+	if processes == 1:
+		for (start, end), tile_shapes in zip(windows, bins):
+			for shape in tile_shapes:
+				blit_window(img, shape, start, end)
+		return img
+
+	memory = shared_memory.SharedMemory(create=True, size=img.img.nbytes)
+	try:
+		buffer = numpy.ndarray(img.img.shape, numpy.uint8, memory.buf)
+		buffer[:] = img.img
+		jobs = [ (memory.name, img.x, img.y, start, end, tile_shapes) for (start, end), tile_shapes in zip(windows, bins) if len(tile_shapes) > 0 ]
+		pool = multiprocessing.Pool(processes)
+		try:
+			for done in pool.imap_unordered(render_tile, jobs): pass
+		finally:
+			pool.close()
+			pool.join()
+		img.img[:] = buffer
+		del buffer
+	finally:
+		memory.close()
+		memory.unlink()
+	return img
+
+# Bands
+def bands(size_y, band_height):
+	"""Splits an image into bands of band_height rows, from the top down. Returns the (min_y, max_y) of every band."""
+	return [ (max(0, size_y - top - band_height), size_y - top - 1) for top in range(0, size_y, band_height) ]
+
+def bin_bands(shapes, size_x, size_y, band_height):
+	"""Returns, for every band, the shapes whose bounding box overlaps its rows, in drawing order."""
+	viewport = (1, 0, size_x, size_y - 1)
+	bins = [ [] for top in range(0, size_y, band_height) ]
+	for shape in shapes:
+		box = shape.bounds()
+		# Shapes outside of the image are never drawn
+		if not overlaps(box, viewport): continue
+		# Bands count down from the top of the image
+		first = (size_y - 1 - min(box[3], size_y - 1)) // band_height
+		last = (size_y - 1 - max(box[1], 0)) // band_height
+		for i in range(first, last + 1):
+			bins[i].append(shape)
+	return bins
+
+def save_banded(path, size_x, size_y, shapes, background=Color(255,255,255), band_height=256, binary=True, inten=255, array=None):
+	"""
+	Draws a list of shapes and saves them as a PPM file, without ever holding the whole
+	image. The image is drawn and written one band of band_height rows at a time, from
+	the top down, and each band only draws the shapes that overlap its rows (clipped to
+	it). The file is the same as drawing every shape onto one Image, and saving it.
+	The shapes themselves are left as they were.
+	Array-backed bands are used if array is True, or if array is None and numpy is there.
+
+	"""
+	if array is None: array = numpy is not None
+	bins = bin_bands(shapes, size_x, size_y, band_height)
+	f = open(path, 'wb')
+	try:
+		f.write( write_header(size_x, size_y, inten, binary) )
+		band = None
+		for (min_y, max_y), band_shapes in zip(bands(size_y, band_height), bins):
+			# Every band but the last is the same size, so its pixels are reused
+			if band is None or band.y != max_y - min_y + 1:
+				band = Image(size_x, max_y - min_y + 1, inten, array)
+			band.fill(background)
+			window = (1, min_y, size_x, max_y)
+			for shape in band_shapes:
+				# Draw a copy, so the points of every shape drawn so far aren't held on to,
+				# and the caller's shapes keep the points they had
+				drawn = copy.copy(shape)
+				drawn.draw(window)
+				# Move the points down from image rows to band rows
+				band.blit_spans([ (y - min_y, x_start, x_end) for y, x_start, x_end in drawn.spans ], drawn.inside_color)
+				band.blit_points([ (point[0], point[1] - min_y) for point in drawn.border ], drawn.border_color)
+			f.write( band.encode(binary) )
+	finally:
+		f.close()
+	return path
+
+# Unit Tests
+def random_scene(seed, count=150, size_x=320, size_y=240):
+	"""A fixed random list of filled and unfilled shapes, partly off of the image, many with pending transforms."""
+	rand = random.Random(seed)
+	shapes = []
+	for i in range(count):
+		color = Color(rand.randrange(256), rand.randrange(256), rand.randrange(256))
+		x, y = rand.randrange(-20, size_x + 20), rand.randrange(-20, size_y + 20)
+		kind = rand.randrange(4)
+		if kind == 0: shape = Line(x, y, x + rand.randrange(-80, 80), y + rand.randrange(-80, 80), color)
+		elif kind == 1: shape = Circle(x, y, rand.randrange(25), color)
+		elif kind == 2: shape = Ellipse(x, y, rand.randrange(30), rand.randrange(20), color)
+		else: shape = Polygon([ (x + rand.randrange(-40, 40), y + rand.randrange(-40, 40)) for j in range(rand.randrange(3, 7)) ], color)
+		if rand.random() < .5: shape.fill(Color(rand.randrange(256), rand.randrange(256), rand.randrange(256)))
+		if rand.random() < .5:
+			shape.translate(rand.randrange(-30, 30), rand.randrange(-30, 30))
+			factor = rand.choice([.5, 1, 1.5, 2])
+			# Circles stay circles, so they can still be rotated by any angle below
+			shape.scale(x, y, factor, factor if kind == 1 else rand.choice([.5, 1, 1.5]))
+			# Ellipses can only be rotated by quarter turns
+			angle = rand.choice([90, 180, 270]) if kind == 2 else rand.randrange(360)
+			shape.rotate(size_x // 2, size_y // 2, angle)
+		shapes.append(shape)
+	return shapes
+
+def unit_test1():
+	"""Testing tiled rendering, in place and across processes, against img.blit on every shape in order"""
+	if numpy is None: return
+	expected = Image(320, 240, array = True)
+	for shape in random_scene(1): expected.blit(shape)
+	for tile_height, processes in [(16, 1), (50, 1), (16, 3), (64, None)]:
+		img = blit_tiled(Image(320, 240, array = True), random_scene(1), tile_height, processes)
+		assert((img.img == expected.img).all())
+
+def unit_test2():
+	"""Testing banded saving against saving one whole image, for list and array bands, in P3 and P6"""
+	handle, path = tempfile.mkstemp(suffix = ".ppm")
+	os.close(handle)
+	try:
+		for array in ([False, True] if numpy is not None else [False]):
+			img = Image(320, 240, array = array)
+			for shape in random_scene(2): img.blit(shape)
+			for binary in [False, True]:
+				img.save(path, binary)
+				with open(path, 'rb') as f: expected = f.read()
+				shapes = random_scene(2)
+				for shape in shapes[::3]: shape.draw()
+				before = [ (shape.border, shape.spans, shape.raster) for shape in shapes ]
+				for band_height in [1, 7, 64, 256]:
+					save_banded(path, 320, 240, shapes, band_height = band_height, binary = binary, array = array)
+					with open(path, 'rb') as f: assert(f.read() == expected)
+				# The caller's shapes keep their points
+				assert([ (shape.border, shape.spans, shape.raster) for shape in shapes ] == before)
+	finally:
+		os.remove(path)
+
+# Main
+if __name__ == "__main__":
+	unit_test1()
+	unit_test2()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# Filename: Scene.py
+# Project Github: http://github.com/super3/ClassDev
+# Author: Shawn Wilkinson <me@super3.org>
+# Author Website: http://super3.org/
+# License: GPLv3 <http://gplv3.fsf.org/>
+
+# Imports
+import random
+from GeoPrimitives import *
+
+# Scene Class
+class Scene:
+	"""
+	A 2D scene: shapes kept in drawing order, with a uniform grid over their bounding
+	boxes, so the shapes near a rectangle or a point are found without testing them all.
+
+	"""
+	# Magic Functions
+	def __init__(self, cell_size=64, max_cells=1024):
+		self.cell_size = cell_size
+		# Shapes spanning more grid cells than this are kept in one list, and checked one by one
+		self.max_cells = max_cells
+		self.shapes = {} # id(shape) -> [order, shape, box], in drawing order
+		self.grid = {} # (column, row) -> set of id(shape)
+		self.large = set()
+		self.count = 0
+	def __len__(self):
+		return len(self.shapes)
+	def __iter__(self):
+		"""Iterates over the shapes in drawing order."""
+		return ( entry[1] for entry in list(self.shapes.values()) )
+	def __contains__(self, shapeObj):
+		return id(shapeObj) in self.shapes
+
+	# Grid
+	def cells(self, box):
+		"""Returns the (min_column, min_row, max_column, max_row) grid cells that a box touches."""
+		size = self.cell_size
+		return (box[0] // size, box[1] // size, box[2] // size, box[3] // size)
+	def index(self, key, box):
+		"""Puts a shape's id into every grid cell its box touches."""
+		min_column, min_row, max_column, max_row = self.cells(box)
+		if (max_column - min_column + 1) * (max_row - min_row + 1) > self.max_cells:
+			self.large.add(key)
+			return
+		for column in range(min_column, max_column + 1):
+			for row in range(min_row, max_row + 1):
+				self.grid.setdefault( (column, row), set() ).add(key)
+	def unindex(self, key, box):
+		"""Takes a shape's id out of every grid cell its box touches."""
+		if key in self.large:
+			self.large.discard(key)
+			return
+		min_column, min_row, max_column, max_row = self.cells(box)
+		for column in range(min_column, max_column + 1):
+			for row in range(min_row, max_row + 1):
+				cell = self.grid[ (column, row) ]
+				cell.discard(key)
+				if len(cell) == 0: del self.grid[ (column, row) ]
+
+	# Shapes
+	def add(self, shapeObj):
+		"""Adds a shape on top of the scene."""
+		key = id(shapeObj)
+		if key in self.shapes:
+			raise ValueError("Shape is already in the scene.")
+		box = shapeObj.bounds()
+		self.shapes[key] = [self.count, shapeObj, box]
+		self.count += 1
+		self.index(key, box)
+		return shapeObj
+	def remove(self, shapeObj):
+		"""Removes a shape from the scene. Returns its last indexed bounding box."""
+		order, shapeObj, box = self.shapes.pop( id(shapeObj) )
+		self.unindex(id(shapeObj), box)
+		return box
+	def update(self, shapeObj):
+		"""
+		Re-indexes a shape after it was changed (moved, transformed, ...), keeping its
+		place in the drawing order. Returns its (old, new) bounding boxes.
+
+		"""
+		key = id(shapeObj)
+		entry = self.shapes[key]
+		old = entry[2]
+		new = shapeObj.bounds()
+		if new != old:
+			self.unindex(key, old)
+			entry[2] = new
+			self.index(key, new)
+		return old, new
+	def bounds(self, shapeObj):
+		"""Returns the bounding box a shape is indexed with."""
+		return self.shapes[ id(shapeObj) ][2]
+
+	# Queries
+	def query(self, box):
+		"""Returns the shapes whose bounding box touches a (min_x, min_y, max_x, max_y) box, in drawing order."""
+		if box[0] > box[2] or box[1] > box[3]: return []
+		min_column, min_row, max_column, max_row = self.cells(box)
+		keys = set(self.large)
+		if (max_column - min_column + 1) * (max_row - min_row + 1) > len(self.grid):
+			# Fewer cells are in use than the box covers, so look at those instead
+			for (column, row), cell in self.grid.items():
+				if min_column <= column <= max_column and min_row <= row <= max_row: keys.update(cell)
+		else:
+			for column in range(min_column, max_column + 1):
+				for row in range(min_row, max_row + 1):
+					cell = self.grid.get( (column, row) )
+					if cell is not None: keys.update(cell)
+		entries = [ self.shapes[key] for key in keys if overlaps(self.shapes[key][2], box) ]
+		entries.sort(key=operator.itemgetter(0))
+		return [ entry[1] for entry in entries ]
+	def at(self, x, y):
+		"""Returns the shapes whose bounding box holds the point (x, y), in drawing order."""
+		return self.query( (x, y, x, y) )
+	def pick(self, x, y):
+		"""Returns the top shape that draws the pixel at (x, y), or None. Shapes are hit-tested exactly, without storing any points."""
+		window = (x, y, x, y)
+		for shapeObj in reversed(self.at(x, y)):
+			shape = shapeObj.transformed()
+			if len(shape.draw_border(window)) > 0: return shapeObj
+			if shapeObj.do_fill and len(shape.draw_spans(window)) > 0: return shapeObj
+		return None
+
+	# Drawing
+	def blit(self, img, window=None):
+		"""
+		Draws the scene onto an image, in order. Only the shapes touching the image (and the
+		window, if one is passed) are drawn, and only inside of it. Returns how many were drawn.
+
+		"""
+		box = img.viewport()
+		if window is not None: box = intersection(box, window)
+		shapes = self.query(box)
+		for shapeObj in shapes:
+			img.blit(shapeObj, box)
+		return len(shapes)
+
+# Dirty Rectangles
+def merge_boxes(boxes):
+	"""Merges overlapping (min_x, min_y, max_x, max_y) boxes, until none of them overlap."""
+	merged = []
+	for box in boxes:
+		found = True
+		while found:
+			found = False
+			for i, other in enumerate(merged):
+				if overlaps(box, other):
+					box = union(box, merged.pop(i))
+					found = True
+					break
+		merged.append(box)
+	return merged
+
+class Canvas:
+	"""
+	Keeps an image in step with a scene, redrawing only what changed. Every change to the
+	scene goes through the canvas, which marks the old and new bounding boxes of the shape
+	as dirty. render() then clears the dirty rectangles, and redraws just the shapes that
+	touch them, clipped to them.
+
+	"""
+	def __init__(self, img, scene=None, background=Color(255,255,255)):
+		self.img = img
+		self.scene = Scene() if scene is None else scene
+		self.background = background
+		self.dirty = [ img.viewport() ]
+
+	# Changes
+	def damage(self, box):
+		"""Marks a (min_x, min_y, max_x, max_y) box of the image to be redrawn."""
+		box = intersection(box, self.img.viewport())
+		if box[0] <= box[2] and box[1] <= box[3]: self.dirty.append(box)
+	def add(self, shapeObj):
+		"""Adds a shape on top of the scene."""
+		self.scene.add(shapeObj)
+		self.damage( self.scene.bounds(shapeObj) )
+		return shapeObj
+	def remove(self, shapeObj):
+		"""Removes a shape from the scene."""
+		self.damage( self.scene.remove(shapeObj) )
+	def changed(self, shapeObj):
+		"""Call after changing a shape (moving, transforming, recoloring, ...), so it is redrawn."""
+		old, new = self.scene.update(shapeObj)
+		self.damage(old)
+		self.damage(new)
+	def move(self, shapeObj, x, y):
+		"""Moves a shape, and marks it as changed."""
+		shapeObj.move(x, y)
+		self.changed(shapeObj)
+
+	# Drawing
+	def render(self):
+		"""Redraws the dirty rectangles since the last render. Returns them."""
+		boxes = merge_boxes(self.dirty)
+		self.dirty = []
+		for box in boxes:
+			# Clear to the background, one row at a time
+			self.img.blit_spans([ (y, box[0], box[2]) for y in range(box[1], box[3] + 1) ], self.background)
+			self.scene.blit(self.img, box)
+		return boxes
+
+# Unit Tests
+def random_shape(rand, size_x, size_y):
+	"""A random line, circle, ellipse, or polygon, filled or not, around an image of size_x by size_y."""
+	color = Color(rand.randrange(256), rand.randrange(256), rand.randrange(256))
+	x, y = rand.randrange(-10, size_x + 10), rand.randrange(-10, size_y + 10)
+	kind = rand.randrange(4)
+	if kind == 0: shape = Line(x, y, x + rand.randrange(-40, 40), y + rand.randrange(-40, 40), color)
+	elif kind == 1: shape = Circle(x, y, rand.randrange(15), color)
+	elif kind == 2: shape = Ellipse(x, y, rand.randrange(20), rand.randrange(12), color)
+	else: shape = Polygon([ (x + rand.randrange(-25, 25), y + rand.randrange(-25, 25)) for i in range(rand.randrange(3, 7)) ], color)
+	if rand.random() < .5: shape.fill(Color(rand.randrange(256), rand.randrange(256), rand.randrange(256)))
+	if rand.random() < .3:
+		# Ellipses can only be rotated by quarter turns
+		shape.rotate(x, y, rand.choice([90, 180, 270]) if kind == 2 else rand.randrange(360))
+	return shape
+
+def unit_test1():
+	"""Testing Scene.pick against hit testing every drawn point of every shape"""
+	rand = random.Random(17)
+	for cell_size, max_cells in [(64, 1024), (8, 4), (1000, 1)]:
+		scene = Scene(cell_size, max_cells)
+		for i in range(40): scene.add( random_shape(rand, 100, 80) )
+		# The top shape drawing every pixel, found the slow way
+		expected = {}
+		for shapeObj in scene:
+			shape = copy.deepcopy(shapeObj)
+			shape.draw()
+			points = shape.border + (shape.inside if shape.do_fill else [])
+			for point in points: expected[ (point[0], point[1]) ] = shapeObj
+		for x in range(-15, 116):
+			for y in range(-15, 96):
+				assert(scene.pick(x, y) is expected.get( (x, y) ))
+
+def unit_test2():
+	"""Testing incremental Canvas.render, after adding, removing, moving, and changing shapes, against a full redraw"""
+	rand = random.Random(18)
+	for array in ([False, True] if numpy is not None else [False]):
+		canvas = Canvas( Image(100, 80, array = array) )
+		shapes = []
+		for step in range(300):
+			action = rand.randrange(4) if len(shapes) > 0 else 0
+			if action == 0:
+				shapes.append( canvas.add(random_shape(rand, 100, 80)) )
+			elif action == 1:
+				canvas.remove( shapes.pop(rand.randrange(len(shapes))) )
+			elif action == 2:
+				canvas.move( rand.choice(shapes), rand.randint(-15, 15), rand.randint(-15, 15) )
+			else:
+				shapeObj = rand.choice(shapes)
+				shapeObj.translate(rand.randint(-5, 5), rand.randint(-5, 5))
+				shapeObj.border_color = Color(rand.randrange(256), rand.randrange(256), rand.randrange(256))
+				canvas.changed(shapeObj)
+			if rand.random() < .2:
+				canvas.render()
+				expected = Image(100, 80, array = array)
+				canvas.scene.blit(expected)
+				assert(canvas.img.encode() == expected.encode())
+
+# Main
+if __name__ == "__main__":
+	unit_test1()
+	unit_test2()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# Filename: Stats.py
+# Project Github: http://github.com/super3/ClassDev
+# Author: Shawn Wilkinson <me@super3.org>
+# Author Website: http://super3.org/
+# License: GPLv3 <http://gplv3.fsf.org/>
+
+# Imports
+import time
+
+# Stats Class
+class Stats:
+	"""
+	Opt-in instrumentation for the engine. When enabled, every stage of a render
+	(alignment, projection, display, drawing per shape type, dedup, fill, blit, save)
+	records its calls, wall time, and items handled, along with how many pixels were
+	generated by the shapes versus written to an image. Call sites check enabled
+	before doing anything, so it costs next to nothing while off.
+
+	"""
+	def __init__(self):
+		self.enabled = False
+		# Print debugging output (like every 3D vertex point made) while enabled
+		self.verbose = False
+		self.reset()
+
+	def reset(self):
+		"""Forgets everything recorded so far."""
+		self.stages = {} # stage -> [calls, seconds, items]
+		self.generated = 0
+		self.written = 0
+
+	# Recording
+	def clock(self):
+		return time.perf_counter()
+	def record(self, stage, start, items=0):
+		"""Records one call of a stage that started at start (from clock()), and handled items."""
+		seconds = time.perf_counter() - start
+		entry = self.stages.get(stage)
+		if entry is None: self.stages[stage] = [1, seconds, items]
+		else:
+			entry[0] += 1
+			entry[1] += seconds
+			entry[2] += items
+	def debug(self, *args):
+		"""Prints debugging output, only when enabled and verbose."""
+		if self.enabled and self.verbose: print(*args)
+
+	# Reporting
+	def summary(self):
+		"""Returns everything recorded as a dict: per stage calls, seconds, and items, and the pixel counts."""
+		return {
+			'stages': dict( (stage, {'calls': calls, 'seconds': seconds, 'items': items}) for stage, (calls, seconds, items) in self.stages.items() ),
+			'pixels': {'generated': self.generated, 'written': self.written},
+		}
+	def report(self):
+		"""Returns the summary as a table, slowest stage first."""
+		lines = [ "%-20s %8s %10s %12s" % ("stage", "calls", "seconds", "items") ]
+		for stage, (calls, seconds, items) in sorted(self.stages.items(), key=lambda item: -item[1][1]):
+			lines.append( "%-20s %8d %10.4f %12d" % (stage, calls, seconds, items) )
+		lines.append( "pixels generated %d, written %d" % (self.generated, self.written) )
+		return "\n".join(lines)
+
+stats = Stats()